@@ -0,0 +1,94 @@
+# song mode: loops chained one after another, each played some number of times, muted or transposed.
+# nothing is expanded ahead of time, the song is streamed a step at a time through a chain of generators
+# so playing a long arrangement of big loops takes no more memory than playing one loop.
+# songs are saved as json (.bhms) listing the patterns, with the loops in files of their own:
+#   {"title": "...", "patterns": [{"loop": "verse.bhmr", "repeats": 4, "transpose": 0, "muted": false}, ...]}
+# loop paths are relative to the song file, and everything but "loop" can be left out
+
+import json
+import os
+import projectfile
+
+SONG_EXTENSION = '.bhms'
+
+class Pattern:
+    # one entry in an arrangement
+    def __init__(self, loop, repeats = 1, transpose = 0, muted = False):
+        self.loop = loop
+        self.repeats = repeats
+        self.transpose = transpose
+        self.muted = muted
+    def length(self):
+        return self.loop.length * self.repeats
+
+class Arrangement:
+    def __init__(self, patterns = None, title = None):
+        self.patterns = [] if patterns is None else list(patterns)
+        if title is None:
+            self.title = "[song]"
+        else:
+            self.title = title
+    def add(self, loop, repeats = 1, transpose = 0, muted = False):
+        pattern = Pattern(loop, repeats, transpose, muted)
+        self.patterns.append(pattern)
+        return pattern
+    def length(self):
+        return sum(pattern.length() for pattern in self.patterns)
+    def pattern_at(self, beat):
+        # (pattern, step within it) playing at beat, or None past the end
+        for pattern in self.patterns:
+            if beat < pattern.length():
+                return pattern, beat
+            beat -= pattern.length()
+        return None
+    def steps(self, start_beat = 0, repeat = False):
+        # (beat, pattern, step) for every step from start_beat on. the patterns are looked at as they're
+        # reached, so changes to ones that haven't started yet are picked up
+        beat = 0
+        while True:
+            for pattern in self.patterns:
+                length = pattern.length()
+                if beat + length > start_beat:
+                    for step in range(max(start_beat - beat, 0), length):
+                        yield beat + step, pattern, step
+                beat += length
+            if not repeat or self.length() == 0:
+                return
+    def stream(self, start_beat = 0, repeat = False):
+        # (beat, messages, bursts, releases) steps for Engine.play
+        return pattern_messages(self.steps(start_beat, repeat))
+
+def is_song(path):
+    return path.endswith(SONG_EXTENSION)
+
+def load(path):
+    # an Arrangement from a .bhms file. each loop file is only loaded once however many patterns play it, so they
+    # share one Loop
+    with open(path, 'r') as file:
+        data = json.loads(file.read())
+    directory = os.path.dirname(path)
+    loops = {} # {path: Loop}
+    arrangement = Arrangement(title = data.get('title'))
+    for pattern in data['patterns']:
+        loop_path = os.path.join(directory, pattern['loop'])
+        if loop_path not in loops:
+            loops[loop_path] = projectfile.load(loop_path)
+        arrangement.add(loops[loop_path], int(pattern.get('repeats', 1)), int(pattern.get('transpose', 0)), bool(pattern.get('muted', False)))
+    return arrangement
+
+def pattern_messages(steps):
+    # turns (beat, pattern, step) into (beat, messages, bursts, releases), applying the pattern's mute and transposition
+    for beat, pattern, step in steps:
+        if pattern.muted:
+            yield beat, (), (), ()
+        elif pattern.transpose == 0:
+            yield beat, pattern.loop.messages_at_time(step), pattern.loop.bursts_at_time(step), pattern.loop.releases_at_time(step)
+        else:
+            yield (beat, transposed(pattern.loop.messages_at_time(step), pattern.transpose),
+                   transposed(pattern.loop.bursts_at_time(step), pattern.transpose),
+                   tuple((gate, transposed(offs, pattern.transpose)) for gate, offs in pattern.loop.releases_at_time(step)))
+
+def transposed(messages, semitones):
+    # works on (port, message) pairs and (port, message, burst, gate). notes pushed out of midi range are dropped
+    return tuple((port, (status, note + semitones, velocity)) + tuple(rest) for port, (status, note, velocity), *rest in messages
+                 if 0 <= note + semitones < 128)
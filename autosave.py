@@ -0,0 +1,133 @@
+# saving off the main thread, and a journal of edits so unsaved work survives a crash
+
+import json
+import os
+import queue
+from threading import Thread, Lock
+import projectfile
+from loop import Loop
+
+JOURNAL_PATH = os.path.join(os.path.expanduser('~'), '.biohammer_journal')
+
+class BackgroundWriter:
+    # one thread that does all the disk writing: saves queued with save(), and flushing the journal
+    # every flush_interval seconds, so neither the editor loop nor the clock ever wait on the disk
+    def __init__(self, journal = None, flush_interval = 1):
+        self.journal = journal
+        self.flush_interval = flush_interval
+        self.saved_revision = None # revision of the loop as of the last save that made it to disk
+        self.queue = queue.Queue()
+        self.thread = Thread(target = self.run, daemon = True)
+        self.thread.start()
+    def save(self, loop, path):
+        # the loop's data is copied now, the slow part (encoding and writing it) happens on the writer thread
+        self.queue.put((loop.data(), path, loop.revision))
+    def mark_saved(self, revision):
+        # for when the loop is already the same as what's on disk, e.g. just after loading it
+        self.saved_revision = revision
+    def wait(self):
+        # block until everything queued so far has been written
+        self.queue.join()
+    def stop(self):
+        self.queue.put(None)
+        self.thread.join()
+    def run(self):
+        while True:
+            try:
+                job = self.queue.get(timeout = self.flush_interval)
+            except queue.Empty:
+                job = ()
+            if job is None:
+                self.flush_journal()
+                self.queue.task_done()
+                return
+            if job:
+                data, path, revision = job
+                try:
+                    projectfile.write_atomic(path, projectfile.dumps(data, path))
+                    self.saved_revision = revision
+                except Exception as e:
+                    print(repr(e))
+                self.queue.task_done()
+            self.flush_journal()
+    def flush_journal(self):
+        if self.journal is not None:
+            try:
+                self.journal.flush()
+            except Exception as e:
+                print(repr(e))
+
+class Journal:
+    # append only log of the edits made to a loop. the first line is the whole loop as it was when the journal was
+    # started and every line after that is one edit, so replaying it gets back to where things were before a crash
+    def __init__(self, path = JOURNAL_PATH):
+        self.path = path
+        self.loop = None
+        self.lock = Lock()
+        self.pending = [] # records not written yet
+        self.truncate = False # start the file again on the next flush rather than appending to it
+    def start(self, loop):
+        # begin a new journal from the loop's current state, after loading or saving it
+        if self.loop is not None:
+            self.loop.listeners.remove(self.record)
+        self.loop = loop
+        loop.listeners.append(self.record)
+        with self.lock:
+            self.pending = [['loop', loop.data()]]
+            self.truncate = True
+    def record(self, operation, *args):
+        with self.lock:
+            self.pending.append([operation, *args])
+    def flush(self):
+        with self.lock:
+            records, self.pending = self.pending, []
+            truncate, self.truncate = self.truncate, False
+        if len(records) == 0:
+            return
+        with open(self.path, 'w' if truncate else 'a') as file:
+            file.write(''.join(json.dumps(record) + '\n' for record in records))
+            file.flush()
+            os.fsync(file.fileno())
+    def discard(self):
+        # for a clean exit, there's nothing to recover
+        if self.loop is not None:
+            self.loop.listeners.remove(self.record)
+            self.loop = None
+        with self.lock:
+            self.pending = []
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+def recover(path = JOURNAL_PATH):
+    # replay a journal left behind by a crash, returns None if there isn't one
+    if not os.path.exists(path):
+        return None
+    loop = None
+    with open(path, 'r') as file:
+        for line in file:
+            try:
+                operation, *args = json.loads(line)
+            except ValueError:
+                break # the last line was only half written
+            if operation == 'loop':
+                loop = Loop.from_data(args[0])
+            elif operation == 'write':
+                loop.write(*args)
+            elif operation == 'add_track':
+                # add_track is recorded with the name the track ended up with. if it's already there it was
+                # the track delete_track adds when the last one goes, which replaying the delete already did
+                if args[0] not in loop.events:
+                    loop.add_track(args[0])
+            elif operation == 'delete_track':
+                loop.delete_track(args[0])
+            elif operation == 'set_length':
+                loop.set_length(args[0])
+            elif operation == 'set_route':
+                loop.set_route(*args)
+            elif operation == 'set_burst':
+                loop.set_burst(*args)
+            elif operation == 'set_track_gate':
+                loop.set_track_gate(*args)
+            elif operation == 'set_gate':
+                loop.set_gate(*args)
+    return loop
@@ -0,0 +1,174 @@
+# benchmarks for biohammer. results are printed as json so they can be kept and compared between releases
+# usage: python benchmark.py [benchmark names...]
+# runs headless: the gui benchmarks use sdl's dummy video driver unless SDL_VIDEODRIVER says otherwise, and midi goes
+# to a stand in port, so rtmidi's native library isn't needed
+
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+from loop import Loop
+import projectfile
+from engine import Engine
+from output import Output, NullPort
+
+def timed(f, repeats = 3):
+    # best time of a few runs, in seconds
+    best = None
+    for i in range(repeats):
+        start = time.perf_counter()
+        f()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def random_loop(tracks, length, density = 0.25, seed = 0):
+    rng = random.Random(seed)
+    events = {f'track {i}': {t: rng.randrange(128) for t in range(length) if rng.random() < density} for i in range(tracks)}
+    return Loop.from_events(length, events, title = f'{tracks}x{length}')
+
+SIZES = ((8, 16), (32, 128), (128, 1024), (128, 16384)) # (tracks, steps)
+
+def per_call(f, calls):
+    # average time of one call in seconds, over calls calls
+    start = time.perf_counter()
+    for i in range(calls):
+        f(i)
+    return (time.perf_counter() - start) / calls
+
+def bench_gui():
+    # building the edit table, drawing it, and hit testing it, with the screen the same size as the editor's
+    import pygame as pg
+    from meatflower import MeatflowerGui
+    from editor import EditTable
+    pg.init()
+    results = {}
+    rng = random.Random(0)
+    for tracks, length in SIZES:
+        loop = random_loop(tracks, length)
+        size = f'{tracks}x{length}'
+        built = {}
+        def build():
+            built['gui'] = MeatflowerGui((1280, 720))
+            built['table'] = built['gui'].add_element(EditTable, (0,0), loop)
+        results[f'build {size}'] = timed(build, repeats = 1)
+        gui, table = built['gui'], built['table']
+        results[f'first frame {size}'] = timed(gui.render, repeats = 1)
+        results[f'idle frame {size}'] = per_call(lambda i: gui.render(), 100)
+        cells = [table.steps.cell_at(x, y) for y in range(min(tracks, 8)) for x in range(min(length, 8))]
+        def edit_frame(i):
+            cells[i % len(cells)].set_value(i % 128)
+            gui.render()
+        results[f'edit frame {size}'] = per_call(edit_frame, 100)
+        points = [(rng.randrange(1280), rng.randrange(720)) for i in range(1000)]
+        results[f'at_point {size}'] = per_call(lambda i: gui.at_point(points[i]), len(points))
+        results[f'scroll frame {size}'] = per_call(lambda i: (table.scroll(1 if i % 20 < 10 else -1, 0), gui.render()), 100)
+        results[f'elements {size}'] = len(gui.elements)
+    pg.quit()
+    return results
+
+def bench_loop():
+    # step lookups as done while playing, and the json round trip
+    results = {}
+    for tracks, length in SIZES:
+        loop = random_loop(tracks, length)
+        size = f'{tracks}x{length}'
+        calls = 100000
+        results[f'events_at_time per second {size}'] = 1 / per_call(loop.events_at_time, calls)
+        results[f'messages_at_time per second {size}'] = 1 / per_call(loop.messages_at_time, calls)
+        results[f'serialise {size}'] = timed(loop.serialise)
+        data = json.loads(loop.serialise())
+        results[f'from_data {size}'] = timed(lambda: Loop.from_data(data))
+    return results
+
+def bench_file_formats():
+    # save and load round trips of the json and binary formats, plus just mapping a binary file without building a Loop
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for tracks, length in ((16, 64), (128, 1024), (256, 4096)):
+            loop = random_loop(tracks, length)
+            size = f'{tracks}x{length}'
+            for extension in ('bhmr', 'bhmb'):
+                path = os.path.join(directory, 'loop.' + extension)
+                results[f'{extension} save {size}'] = timed(lambda: projectfile.save(loop, path))
+                results[f'{extension} load {size}'] = timed(lambda: projectfile.load(path))
+                results[f'{extension} bytes {size}'] = os.path.getsize(path)
+            def open_mapped():
+                with projectfile.BinaryProject(path) as project:
+                    for track in project.tracks:
+                        project.steps(track).release()
+            results[f'bhmb map {size}'] = timed(open_mapped)
+    return results
+
+def bench_timing(seconds = 5, bpm = 960):
+    # plays a dense loop through the engine and output worker into a stand in port and reports how late messages went
+    # out, in milliseconds. runs in real time, so it's slow, and the numbers depend on how busy the machine is
+    loop = random_loop(16, 64, density = 0.5)
+    output = Output(make_port = NullPort)
+    output.set_default('null')
+    engine = Engine()
+    engine.start()
+    engine.restart(bpm)
+    engine.play(loop.stream(), output.send)
+    time.sleep(seconds)
+    engine.stop()
+    output.stop()
+    return {'stats': output.timing.stats(), 'histogram': output.timing.histogram()}
+
+def bench_busy_timing(seconds = 5, bpm = 960):
+    # bench_timing while the main thread keeps rebuilding a big edit table, as the editor does loading a loop, with the
+    # engine in this process and then in a child process (see engineprocess.py), to see how much the ui holds it up
+    import pygame as pg
+    from meatflower import MeatflowerGui
+    from editor import EditTable
+    from engineprocess import EngineProcess
+    pg.init()
+    loop = random_loop(16, 64, density = 0.5)
+    big = random_loop(128, 1024)
+    def rebuild(seconds):
+        rebuilds = 0
+        end = time.perf_counter() + seconds
+        while time.perf_counter() < end:
+            gui = MeatflowerGui((1280, 720))
+            gui.add_element(EditTable, (0,0), big)
+            gui.render()
+            rebuilds += 1
+        return rebuilds
+    results = {}
+    output = Output(make_port = NullPort)
+    output.set_default('null')
+    engine = Engine()
+    engine.start()
+    engine.restart(bpm)
+    engine.play(loop.stream(), output.send)
+    results['in process rebuilds'] = rebuild(seconds)
+    engine.stop()
+    output.stop()
+    results['in process'] = output.timing.stats()
+    process = EngineProcess(make_port = NullPort)
+    process.start()
+    process.set_default('null')
+    time.sleep(1) # let the child start up, or the first steps are late waiting for it
+    process.restart(bpm)
+    process.play_loop(loop)
+    results['engine process rebuilds'] = rebuild(seconds)
+    process.stop()
+    results['engine process'] = process.timing.stats()
+    pg.quit()
+    return results
+
+BENCHMARKS = {
+    'gui': bench_gui,
+    'loop': bench_loop,
+    'file_formats': bench_file_formats,
+    'timing': bench_timing,
+    'busy_timing': bench_busy_timing,
+}
+
+if __name__ == '__main__':
+    names = sys.argv[1:] if len(sys.argv) > 1 else list(BENCHMARKS)
+    print(json.dumps({name: BENCHMARKS[name]() for name in names}, indent = 1))
@@ -0,0 +1,70 @@
+# turning bursts (see loop.NO_BURST) into individual hits. everything's worked out for all the bursts in a lookahead
+# window at once with numpy, rather than one hit at a time, so dense bursts on lots of tracks stay cheap to schedule
+
+import numpy as np
+from midiconstants import NOTE_OFF
+
+rng = np.random.default_rng()
+
+def expand(bursts):
+    # (burst index, offset into the step, offset of the next hit or 1 for the last, velocity) as arrays, for every
+    # hit of every burst in the list that plays
+    counts, curves, starts, ends, probabilities = np.array(bursts, dtype = float).reshape(-1, 5).T
+    counts = counts.astype(np.int64)
+    owner = np.repeat(np.arange(len(counts)), counts)
+    index = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) # which hit of its burst each one is
+    offsets = (index / counts[owner]) ** curves[owner]
+    next_offsets = ((index + 1) / counts[owner]) ** curves[owner]
+    velocities = starts[owner] + ((ends[owner] - starts[owner]) * index / np.maximum(counts[owner] - 1, 1))
+    velocities = np.clip(np.rint(velocities), 1, 127).astype(np.int64)
+    plays = rng.random(len(owner)) < probabilities[owner]
+    return owner[plays], offsets[plays], next_offsets[plays], velocities[plays]
+
+def burst_hits(bursts, gates):
+    # [[(offset into the step, offset of its note off, velocity) of each hit that plays] for each burst], for when
+    # times aren't needed. gates has the gate for each burst, see loop.DEFAULT_GATE
+    owner, offsets, next_offsets, velocities = expand(bursts)
+    offs = offsets + (np.array(gates, dtype = float)[owner] * (next_offsets - offsets))
+    hits = [[] for burst in bursts]
+    for i, offset, off, velocity in zip(owner.tolist(), offsets.tolist(), offs.tolist(), velocities.tolist()):
+        hits[i].append((offset, off, velocity))
+    return hits
+
+def times_at(tempo, beats):
+    # TempoMap.time_at for an array of beats
+    segments = np.array(tempo.segments, dtype = float)
+    i = np.maximum(np.searchsorted(np.array(tempo.beats, dtype = float), beats, side = 'right') - 1, 0)
+    start_beat, start_time, bpm, end_bpm, ramp_beats = segments[i].T
+    elapsed = beats - start_beat
+    steady = (ramp_beats == 0) | (end_bpm == bpm)
+    k = np.where(steady, 1, (end_bpm - bpm) / np.where(ramp_beats == 0, 1, ramp_beats))
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        ramped = start_time + ((60 / k) * np.log((bpm + (k * elapsed)) / bpm))
+    return np.where(steady, start_time + (elapsed * 60 / bpm), ramped)
+
+def schedule_hits(tempo, bursts):
+    # bursts is [(beat, port, message, burst, gate)]. returns ([(time, beat, ((port, message), ...))] of note ons,
+    # [(time, beat, ((port, message), ...))] of note offs) for every hit that plays (after probability), grouped by
+    # when they're due so hits at the same moment go out as one event
+    if len(bursts) == 0:
+        return [], []
+    owner, offsets, next_offsets, velocities = expand([burst for beat, port, message, burst, gate in bursts])
+    beats = np.array([beat for beat, port, message, burst, gate in bursts], dtype = float)[owner]
+    gates = np.array([gate for beat, port, message, burst, gate in bursts], dtype = float)[owner]
+    hit_beats = beats + offsets
+    off_beats = hit_beats + (gates * (next_offsets - offsets))
+    owner = owner.tolist()
+    ons = grouped(times_at(tempo, hit_beats), hit_beats, [(bursts[i][1], (bursts[i][2][0], bursts[i][2][1], velocity)) for i, velocity in zip(owner, velocities.tolist())])
+    offs = grouped(times_at(tempo, off_beats), off_beats, [(bursts[i][1], (NOTE_OFF | (bursts[i][2][0] & 0x0F), bursts[i][2][1], 0)) for i in owner])
+    return ons, offs
+
+def grouped(times, beats, messages):
+    # [(time, beat, messages due then)] in time order, from an array of times and beats and a list with a message for each
+    order = np.argsort(times, kind = 'stable')
+    groups = {} # {time: [beat, messages]}
+    for i, t, beat in zip(order.tolist(), times[order].tolist(), beats[order].tolist()):
+        group = groups.get(t)
+        if group is None:
+            group = groups[t] = [beat, []]
+        group[1].append(messages[i])
+    return [(t, beat, tuple(due)) for t, (beat, due) in groups.items()]
@@ -0,0 +1,199 @@
+# headless playback: plays loops through midi with no window, controlled over a unix socket.
+# one command per line, each answered with one line of json, {"ok": ...} or {"error": ...}:
+#   load <path>                 load a .bhmr or .bhmb file or a .bhms song, if playing it carries on from the same beat
+#   play                        start from the beginning of the loop or song
+#   stop
+#   continue                    carry on from where it stopped
+#   tempo <bpm> [ramp beats]    change tempo now, or ramp to it over some beats
+#   port <name>                 send to this port (tracks routed to a particular port still go there)
+#   route <track> <port> <ch>   send a track to a port, or default for the default port, on channel 0-15. for a song
+#                               it's routed in each of its loops that has the track
+#   ports                       list midi ports
+#   status                      what's playing, and for a song which of its patterns (counting from 0)
+#   quit                        stop the daemon
+# e.g. echo play | nc -U /tmp/biohammer.sock
+# it can send midi clock through the default port (clock_out), and follow the clock coming in on another port
+# (clock_in), starting, stopping and continuing along with it. songs go back to the start at the end, like loops
+
+import asyncio
+import json
+from math import ceil
+import os
+import signal
+from engine import Engine
+from output import Output
+from midiclock import ClockOut, ClockIn, midi_in
+import arrangement
+import projectfile
+
+class Daemon:
+    def __init__(self, socket_path, output = None, bpm = 120, clock_out = False, clock_in = None, make_in = midi_in):
+        self.socket_path = socket_path
+        self.output = Output() if output is None else output
+        self.engine = Engine()
+        self.engine.start()
+        self.bpm = bpm
+        self.loop = None # the Loop or Arrangement being played
+        self.playing = False
+        self.stopped_at = 0 # beat it was up to when it was stopped, for continue
+        self.clock_out = ClockOut(self.engine, self.output.send) if clock_out else None
+        self.clock_in_port = clock_in # name of the port to follow the clock on, opened by serve()
+        self.make_in = make_in # makes the port, or a stand in like output.Loopback.make_in
+        self.clock_in = None
+        self.stopped = None # set to stop serving, made in serve() so it belongs to the right event loop
+        self.clients = {} # {writer: the task handling it}
+        self.commands = {'load': self.load, 'play': self.play, 'stop': self.stop, 'continue': self.resume, 'tempo': self.tempo,
+                         'port': self.port, 'route': self.route, 'ports': self.ports, 'status': self.status, 'quit': self.quit}
+    async def serve(self):
+        self.stopped = asyncio.Event()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path) # left behind by a daemon that didn't exit cleanly
+        server = await asyncio.start_unix_server(self.handle, path = self.socket_path)
+        event_loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            event_loop.add_signal_handler(signum, self.stopped.set)
+        if self.clock_in_port is not None:
+            # the port calls these from its own thread, they're handed over to the event loop like commands
+            self.clock_in = ClockIn(self.engine, self.clock_in_port, make_port = self.make_in,
+                                    on_start = lambda t: event_loop.call_soon_threadsafe(self.follow, 0, t),
+                                    on_continue = lambda beat, t: event_loop.call_soon_threadsafe(self.follow, beat, t),
+                                    on_stop = lambda: event_loop.call_soon_threadsafe(self.stop_playing))
+        async with server:
+            await self.stopped.wait()
+            # hang up on anyone still connected and let their handlers finish rather than being cancelled
+            for writer in self.clients:
+                writer.close()
+            await asyncio.gather(*self.clients.values())
+        if self.clock_in is not None:
+            self.clock_in.close()
+        self.engine.stop()
+        self.output.stop()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+    async def handle(self, reader, writer):
+        self.clients[writer] = asyncio.current_task()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                writer.write((json.dumps(await self.command(line.decode('utf-8'))) + '\n').encode('utf-8'))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            del self.clients[writer]
+            writer.close()
+    async def command(self, line):
+        words = line.split()
+        if len(words) == 0:
+            return {'error': 'empty command'}
+        if words[0] not in self.commands:
+            return {'error': f'unknown command {words[0]}'}
+        try:
+            return {'ok': await self.commands[words[0]](*words[1:])}
+        except Exception as e:
+            return {'error': repr(e)}
+    async def load(self, *path):
+        path = ' '.join(path) # paths can have spaces in
+        # off the event loop, so other connections aren't held up by the disk
+        loop = await asyncio.to_thread(arrangement.load if arrangement.is_song(path) else projectfile.load, path)
+        self.loop = loop
+        if self.playing:
+            self.engine.play(self.stream(self.engine.scheduled_up_to + 1), self.output.send, release = self.output.release)
+        return loop.title
+    def stream(self, start_beat):
+        if isinstance(self.loop, arrangement.Arrangement):
+            return self.loop.stream(start_beat, repeat = True)
+        return self.loop.stream(start_beat)
+    async def play(self):
+        if self.loop is None:
+            raise ValueError('nothing loaded')
+        self.start_playing()
+        return True
+    async def stop(self):
+        self.stop_playing()
+        return True
+    async def resume(self):
+        if self.loop is None:
+            raise ValueError('nothing loaded')
+        self.start_playing(self.stopped_at)
+        return self.stopped_at
+    def start_playing(self, beat = 0, start_time = None):
+        # play from beat, with it happening at start_time (by default now). steps are whole beats, so from part way
+        # through one the loop picks up at the next
+        if start_time is None:
+            start_time = self.engine.now()
+        self.engine.restart(self.bpm, start_time - (beat * 60 / self.bpm))
+        self.engine.play(self.stream(ceil(beat)), self.output.send, release = self.output.release)
+        self.playing = True
+        if self.clock_out is not None:
+            if beat == 0:
+                self.clock_out.start()
+            else:
+                self.clock_out.resume(beat)
+    def stop_playing(self):
+        if self.playing:
+            self.stopped_at = self.engine.beat_at(self.engine.now())
+        self.engine.restart(self.bpm)
+        self.playing = False
+        if self.clock_out is not None:
+            self.clock_out.stop()
+    def follow(self, beat, t):
+        # the clock being followed started or continued
+        if self.loop is None:
+            return
+        self.bpm = self.clock_in.bpm() or self.bpm
+        self.start_playing(beat, t)
+    async def tempo(self, bpm, ramp_beats = None):
+        bpm = float(bpm)
+        if bpm <= 0:
+            raise ValueError('tempo has to be more than 0')
+        self.bpm = bpm
+        if ramp_beats is None:
+            self.engine.set_tempo(bpm)
+        else:
+            self.engine.ramp_tempo(bpm, float(ramp_beats))
+        return bpm
+    async def port(self, *name):
+        self.output.set_default(' '.join(name))
+        return True
+    async def route(self, track, *port_and_channel):
+        if self.loop is None:
+            raise ValueError('nothing loaded')
+        if len(port_and_channel) < 2:
+            raise ValueError('route needs a track, a port and a channel')
+        *port, channel = port_and_channel # port names can have spaces in
+        port = ' '.join(port)
+        port = None if port == 'default' else port
+        channel = int(channel)
+        if not 0 <= channel < 16:
+            raise ValueError(f'{channel} is not a midi channel (0-15)')
+        loops = [pattern.loop for pattern in self.loop.patterns] if isinstance(self.loop, arrangement.Arrangement) else [self.loop]
+        loops = list({id(loop): loop for loop in loops if track in loop.steps}.values()) # a loop can be in a song more than once
+        if len(loops) == 0:
+            raise ValueError(f'no track {track}')
+        for loop in loops:
+            loop.set_route(track, port, channel)
+        if port is not None:
+            self.output.open(port) # tries again if it couldn't be opened before
+        return True
+    async def ports(self):
+        return self.output.port_names()
+    async def status(self):
+        bpm = None if self.clock_in is None else self.clock_in.bpm() # the clock being followed's, once there is one
+        if bpm is None:
+            bpm = self.bpm
+        beat = self.engine.beat_at(self.engine.now()) if self.playing else None
+        status = {'playing': self.playing, 'bpm': bpm, 'beat': beat,
+                  'loop': None if self.loop is None else self.loop.title, 'length': None if self.loop is None else self.loop.length}
+        if isinstance(self.loop, arrangement.Arrangement):
+            status['length'] = self.loop.length()
+            status['pattern'] = None
+            if beat is not None and status['length'] > 0:
+                pattern, step = self.loop.pattern_at(int(beat) % status['length'])
+                status['pattern'] = self.loop.patterns.index(pattern)
+        return status
+    async def quit(self):
+        self.stopped.set()
+        return True
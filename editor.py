@@ -0,0 +1,357 @@
+# the editor window. only imported when it's opened, see biohammer.py
+
+# gui
+import pygame as pg
+from meatflower import MeatflowerGui, Cell, Text, EditableText, Row, Column, ScrollGrid, Dropdown
+
+# sequencing
+from engine import Engine
+from output import Output
+from loop import Loop, NO_BURST
+
+# saving
+import projectfile
+from autosave import BackgroundWriter, Journal, recover
+
+# keys that change the burst on the selected step, each takes a burst (see loop.NO_BURST) and gives the new one.
+# ] [ more or fewer hits, } { bunch them towards the end or the start of the step, ) ( more or less likely to play,
+# v goes through louder towards the end, quieter towards the end and flat
+VELOCITY_RAMPS = ((127, 127), (40, 127), (127, 40))
+BURST_KEYS = {
+    ']': lambda b: (min(b[0] + 1, 64),) + b[1:],
+    '[': lambda b: (max(b[0] - 1, 1),) + b[1:],
+    '}': lambda b: (b[0], round(min(b[1] * 1.25, 4), 3)) + b[2:],
+    '{': lambda b: (b[0], round(max(b[1] / 1.25, 0.25), 3)) + b[2:],
+    ')': lambda b: b[:4] + (round(min(b[4] + 0.1, 1), 1),),
+    '(': lambda b: b[:4] + (round(max(b[4] - 0.1, 0.1), 1),),
+    'v': lambda b: b[:2] + VELOCITY_RAMPS[(VELOCITY_RAMPS.index(b[2:4]) + 1) % len(VELOCITY_RAMPS) if b[2:4] in VELOCITY_RAMPS else 0] + b[4:],
+}
+# keys that change how much of its step the selected note is held for (see loop.DEFAULT_GATE): . , longer or
+# shorter for just that note, > < for its whole track
+GATE_KEYS = {'.': 0.125, ',': -0.125, '>': 0.125, '<': -0.125}
+MAX_OCTAVE = 9 # the highest octave every note key still gives a midi note (0-127) in
+
+class Editor:
+    def __init__(self, timing_path = None, engine_process = False):
+        self.timing_path = timing_path # where to save timing measurements on exit, .csv or .json
+        pg.init()
+        self.screen = pg.display.set_mode((1280, 720))
+        self.gui = MeatflowerGui((1280,720))
+        self.engine_process = engine_process
+        if engine_process:
+            # the clock and output in a child process, away from rendering. it stands in for both
+            from engineprocess import EngineProcess
+            self.engine = self.output = EngineProcess()
+        else:
+            self.output = Output()
+            self.engine = Engine()
+        self.engine.start()
+        self.set_midi_port(0)
+        self.journal = Journal()
+        self.writer = BackgroundWriter(journal = self.journal)
+    def play_loop(self, loop):
+        # carries on from the step after the last one played, so from the start after engine.restart(). the engine
+        # pulls steps in as it needs them, scheduling by beat so its tempo map turns steps into times
+        if self.engine_process:
+            self.engine.play_loop(loop)
+        else:
+            self.engine.play(loop.stream(self.engine.scheduled_up_to + 1), self.output.send, release = self.output.release)
+    def set_midi_port(self, index):
+        # the port for tracks that aren't routed anywhere else. opened by the output worker, so this doesn't wait for it
+        self.midi_out_name = self.output.port_names()[index]
+        self.output.set_default(self.midi_out_name)
+    def edit(self, loop = None):
+        from plyer import filechooser # slow to import, and only needed once there's a window
+        if loop is None:
+            loop = recover(self.journal.path)
+            if loop is not None:
+                print('recovered unsaved work from the last session')
+            else:
+                loop = Loop(8,['track 1'])
+        self.journal.start(loop)
+        title = self.gui.add_element(EditableText, (0,0), loop.title, colour = (0,0,0))
+        length_value = self.gui.add_element(EditableText, (0,0), str(loop.length))
+        length_control = self.gui.add_element(Row, (0,0), [self.gui.add_element(Text, (0,0), 'length:'), length_value], padding = 0)
+        midiout_control = self.gui.add_element(Dropdown, (0,0), self.output.port_names())
+        save_button = self.gui.add_element(Text, (0,0), 'save')
+        load_button = self.gui.add_element(Text, (0,0), 'load')
+        topbar = self.gui.add_element(Row, (0,0), [title, length_control, midiout_control, save_button, load_button])
+        edit_table = self.gui.add_element(EditTable, (0,0), loop)
+        play_button = self.gui.add_element(Text, (0,0), 'play >')
+        octave_value = self.gui.add_element(EditableText, (0,0), '4')
+        octave_control = self.gui.add_element(Row, (0,0), [self.gui.add_element(Text, (0,0), 'octave:'), octave_value], padding = 0)
+        add_track_button = self.gui.add_element(Text, (0,0), 'add track')
+        bpm_value = self.gui.add_element(EditableText, (0,0), '120')
+        bpm_control = self.gui.add_element(Row, (0,0), [self.gui.add_element(Text, (0,0), 'bpm:'), bpm_value], padding = 0)
+        
+        controls = self.gui.add_element(Row, (0,0), [play_button, octave_control, add_track_button, bpm_control])
+        layout = self.gui.add_element(Column, (0,0), [topbar, edit_table, controls])
+
+        _screen_size = self.gui.screen.get_size()
+        save_alert = self.gui.add_element(Alert, ((_screen_size[0]/2)-250,(_screen_size[1]/2)-50), (500,100), 'you have unsaved work, save first if you want to keep it')
+        save_alert.disable()
+
+        bpm = 0
+        playing = False
+        octave = 4
+        playhead_rect = None
+
+        # the controls are only looked at when they change
+        def bpm_changed(elem):
+            nonlocal bpm
+            try:
+                new_bpm = int(elem.text)
+                assert new_bpm > 0
+                if new_bpm != bpm:
+                    bpm = new_bpm
+                    self.engine.set_tempo(bpm) # keeps the beat phase and retimes what's already queued
+                elem.colour = (128,128,128)
+            except:
+                elem.colour = (200,0,0)
+        def length_changed(elem):
+            try:
+                length = int(elem.text)
+                assert length > 0
+                if length != loop.length:
+                    loop.set_length(length)
+                    edit_table.set_length()
+                elem.colour = (128,128,128)
+            except Exception as e:
+                print(e)
+                elem.colour = (200,0,0)
+        def midiout_changed(elem):
+            if elem.value != self.midi_out_name:
+                available_ports = self.output.port_names()
+                self.set_midi_port(available_ports.index(elem.value) if elem.value in available_ports else 0)
+        def octave_changed(elem):
+            nonlocal octave
+            try:
+                new_octave = int(elem.text)
+                assert 0 <= new_octave <= MAX_OCTAVE
+                octave = new_octave
+                elem.colour = (128,128,128)
+            except:
+                elem.colour = (200,0,0)
+        for control, changed in ((bpm_value, bpm_changed), (length_value, length_changed), (midiout_control, midiout_changed), (octave_value, octave_changed)):
+            control.listeners.append(changed)
+            changed(control)
+        pg.event.set_blocked(pg.MOUSEMOTION) # not used, and would wake the loop up for nothing
+
+        while True:
+            updated = self.gui.render()
+            for rect in updated:
+                self.screen.blit(self.gui.screen, rect, rect)
+            # the playhead is drawn straight onto the screen, so put back what was under it before drawing it again
+            if playhead_rect is not None:
+                self.screen.blit(self.gui.screen, playhead_rect, playhead_rect)
+                updated.append(playhead_rect)
+                playhead_rect = None
+            # sleep until there's an event or something to redraw: the playhead moving on to the next step or the overlay
+            timeout = self.gui.next_update()
+            if playing:
+                beat = self.engine.beat_at(self.engine.now())
+                column = edit_table.step_column(int(beat) % loop.length)
+                if column is not None:
+                    topcell, bottomcell = column
+                    playhead_rect = pg.draw.line(self.screen, (250,250,250), topcell.rect.midtop, bottomcell.rect.midbottom, width=2)
+                    updated.append(playhead_rect)
+                next_step = int(((self.engine.time_at(int(beat) + 1) - self.engine.now()) * 1000) + 1)
+                timeout = next_step if timeout is None else min(timeout, next_step)
+            if len(updated) > 0:
+                pg.display.update(updated)
+            if timeout is None:
+                events = [pg.event.wait()]
+            else:
+                events = [pg.event.wait(max(timeout, 1))] # NOEVENT if it timed out, which nothing below matches
+            events += pg.event.get()
+
+            for event in events:
+                if event.type == pg.QUIT:
+                    self.writer.wait()
+                    if loop.revision != self.writer.saved_revision and not save_alert.selected:
+                        save_alert.enable()
+                        self.gui.select_element(save_alert)
+                    else:
+                        self.engine.stop()
+                        self.output.stop()
+                        if self.timing_path is not None:
+                            self.output.timing.dump(self.timing_path)
+                        self.writer.stop()
+                        self.journal.discard()
+                        pg.quit()
+                        return False
+                elif event.type == pg.MOUSEBUTTONDOWN:
+                    clicked_on = self.gui.at_point(event.pos)
+                    ignored = 0 # keep track of Rows, Tables etc that we clicked in but don't do anything with
+                    for elem in clicked_on:
+                        if isinstance(elem, NoteCell) or isinstance(elem, EditableText):
+                            self.gui.select_element(elem)
+                        elif edit_table.is_delete_button(elem):
+                            self.gui.select_element(None)
+                            edit_table.delete_track(elem)
+                        elif isinstance(elem, Dropdown):
+                            if elem.selected:
+                                elem.clicked(event.pos)
+                            else:
+                                self.gui.select_element(elem)
+                        elif elem == play_button:
+                            self.gui.select_element(None)
+                            playing = not playing
+                            self.engine.restart(bpm)
+                            if playing:
+                                self.play_loop(loop)
+                            play_button.set_text('pause ||' if playing else 'play >')
+                        elif elem == add_track_button:
+                            self.gui.select_element(None)
+                            loop.add_track('new track')
+                            edit_table.update_tracks()
+                        elif elem == save_button:
+                            filename = filechooser.save_file()[0]
+                            if filename is not None:
+                                if '.' not in filename:
+                                    filename += '.bhmr'
+                                self.writer.save(loop, filename)
+                                self.journal.start(loop)
+                        elif elem == load_button:
+                            filename = filechooser.open_file()[0]
+                            if filename is not None:
+                                loop = projectfile.load(filename)
+                                if playing:
+                                    # carry on from where the old loop was up to
+                                    self.play_loop(loop)
+                                self.writer.mark_saved(loop.revision)
+                                self.journal.start(loop)
+                                edit_table.bind(loop)
+                                length_value.set_text(str(loop.length))
+                        else:
+                            ignored += 1
+                    if ignored == len(clicked_on):
+                        self.gui.select_element(None)
+                elif event.type == pg.MOUSEWHEEL:
+                    # the cells get reused for other steps, so whatever was selected would stop being what was selected
+                    self.gui.select_element(None)
+                    if pg.key.get_mods() & pg.KMOD_SHIFT:
+                        edit_table.scroll(-event.y, 0)
+                    else:
+                        edit_table.scroll(event.x, -event.y)
+                elif event.type == pg.KEYDOWN and event.key == pg.K_F3:
+                    # toggle how late midi messages are going out
+                    self.gui.set_overlay(None if self.gui.overlay is not None else self.output.timing.summary, position = (0,660))
+                elif event.type == pg.KEYDOWN:
+                    if self.gui.selected_element is None and event.unicode in '1234567890':
+                        octave_value.set_text(event.unicode)
+                    if isinstance(self.gui.selected_element, NoteCell):
+                        # capitals are sharps, so shift-c is C# but shift-e if F
+                        notes = {'c': 0, 'C': 1, 'd': 2, 'D': 3, 'e': 4, 'E': 5, 'f': 5, 'F': 6, 'g': 7, 'G': 8, 'a': 9, 'A': 10, 'b': 11, 'B': 0}
+                        if event.unicode in notes:
+                            cell = self.gui.selected_element
+                            loop.write(cell.track, cell.index, notes[event.unicode] + (12*octave))
+                            cell.set_value(loop.events[cell.track][cell.index], loop.bursts[cell.track].get(cell.index))
+                        elif event.unicode in BURST_KEYS and self.gui.selected_element.value is not None:
+                            cell = self.gui.selected_element
+                            burst = BURST_KEYS[event.unicode](NO_BURST if cell.burst is None else cell.burst)
+                            loop.set_burst(cell.track, cell.index, burst)
+                            cell.set_value(cell.value, loop.bursts[cell.track].get(cell.index))
+                        elif event.unicode in GATE_KEYS and self.gui.selected_element.value is not None:
+                            cell = self.gui.selected_element
+                            if event.unicode in '<>':
+                                loop.set_track_gate(cell.track, loop.gates[cell.track] + GATE_KEYS[event.unicode])
+                            else:
+                                gate = loop.note_gates[cell.track].get(cell.index, loop.gates[cell.track])
+                                loop.set_gate(cell.track, cell.index, gate + GATE_KEYS[event.unicode])
+                    else:
+                        self.gui.keypress(event)
+
+class NoteCell(Cell):
+    __slots__ = ('value', 'burst', 'track', 'index')
+    def __init__(self, position, size, value, colour = (128,128,128), gui = None):
+        super().__init__(position, size, '', colour = colour, gui = gui)
+        self.track = None
+        self.index = None
+        self.set_value(value)
+    def set_value(self, value, burst = None):
+        self.value = value
+        self.burst = burst
+        label = self.midinum_to_name(value)
+        if burst is not None and value is not None:
+            label += f'x{burst[0]}'
+        self.set_label(label)
+    def midinum_to_name(self, n):
+        if n is None:
+            return ''
+        else:
+            octave = n // 12
+            note = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B'][n % 12]
+            return f'{note}{octave}'
+
+class Alert(Cell):
+    # a message that goes away when it's deselected
+    __slots__ = ()
+    def deselect(self):
+        super().deselect()
+        self.disable()
+
+class EditTable(Row):
+    # one row per track: its name, a NoteCell per step and a delete button at the end. each column is a ScrollGrid
+    # so only what fits in view_size has widgets, however long the loop is, and scrolling rebinds them to other
+    # steps and tracks. the names and buttons scroll up and down with the steps
+    __slots__ = ('loop', 'tracks', 'names', 'steps', 'buttons')
+    def __init__(self, position, loop, view_size = (1260, 600), colour = (0,0,0), gui = None):
+        self.loop = loop
+        self.tracks = list(loop.events)
+        padding = 0.5
+        gap = gui.scale * padding
+        rows = len(self.tracks)
+        self.names = gui.add_element(ScrollGrid, (0,0), (100, view_size[1]), (1, rows), (100, 30),
+                                     lambda: gui.add_element(EditableText, (0,0), ''), self.bind_name, padding = padding)
+        self.steps = gui.add_element(ScrollGrid, (0,0), (view_size[0] - 130 - (4 * gap), view_size[1]), (loop.length, rows), (30, 30),
+                                     lambda: gui.add_element(NoteCell, (0,0), (30,30), None), self.bind_note, padding = padding)
+        self.buttons = gui.add_element(ScrollGrid, (0,0), (30, view_size[1]), (1, rows), (30, 30),
+                                       lambda: gui.add_element(Cell, (0,0), (30,30), 'X', colour = (200,200,200)), self.bind_button, padding = padding)
+        super().__init__(position, [self.names, self.steps, self.buttons], padding = padding, colour = colour, gui = gui)
+    def bind_name(self, cell, x, y):
+        cell.set_text(self.tracks[y])
+    def bind_note(self, cell, x, y):
+        cell.track = self.tracks[y]
+        cell.index = x
+        value = self.loop.events[cell.track].get(x)
+        burst = self.loop.bursts[cell.track].get(x)
+        if value != cell.value or burst != cell.burst:
+            cell.set_value(value, burst)
+    def bind_button(self, cell, x, y):
+        pass # they're all the same
+    def is_delete_button(self, elem):
+        return elem in self.buttons.keys
+    def update_tracks(self):
+        # after tracks have been added or deleted
+        self.tracks = list(self.loop.events)
+        rows = len(self.tracks)
+        self.names.set_grid_size((1, rows))
+        self.buttons.set_grid_size((1, rows))
+        self.steps.set_grid_size((self.loop.length, rows))
+        self.scroll(0, 0)
+        for grid in (self.names, self.steps, self.buttons):
+            grid.refresh()
+    def delete_track(self, btn):
+        self.loop.delete_track(self.tracks[self.buttons.grid_position(btn)[1]])
+        self.update_tracks() # deleting the last track adds a new empty one
+    def set_length(self):
+        # show steps up to the loop's length
+        self.steps.set_grid_size((self.loop.length, len(self.tracks)))
+    def bind(self, loop):
+        # switch to editing a different loop
+        self.loop = loop
+        self.update_tracks()
+    def scroll(self, dx, dy):
+        self.steps.scroll(dx, dy)
+        y = self.steps.scroll_position[1]
+        self.names.scroll_to(0, y)
+        self.buttons.scroll_to(0, y)
+    def step_column(self, step):
+        # the top and bottom cells in view for step, or None if it's scrolled out of view
+        x, y = self.steps.scroll_position
+        rows = self.steps.view_cells()[1]
+        top = self.steps.cell_at(step, y)
+        if top is None:
+            return None
+        return top, self.steps.cell_at(step, y + rows - 1)
@@ -0,0 +1,308 @@
+# real-time sequencing engine for biohammer
+
+import heapq
+import itertools
+import time
+from bisect import bisect_right
+from math import exp, log
+from threading import Thread, Condition
+
+MAX_REFILL_HITS = 2048 # burst hits worked out per refill, more than this in the lookahead is spread over several
+SIMULTANEOUS = 1e-6 # seconds apart that a note off and another event count as due at the same time, see run()
+
+class TempoMap:
+    # maps beat positions to engine times and back. it's a list of segments, each starting at a beat and a time, with a
+    # tempo that's either constant or changes linearly (per beat) from bpm to end_bpm over ramp_beats beats
+    def __init__(self, bpm = 120, start_time = 0):
+        self.reset(bpm, start_time)
+    def reset(self, bpm, start_time):
+        self.segments = [(0, start_time, bpm, bpm, 0)] # (beat, time, bpm, end_bpm, ramp_beats)
+        self.beats = [0] # segment start beats and times, for bisecting
+        self.times = [start_time]
+    def segment_at_beat(self, beat):
+        return self.segments[max(bisect_right(self.beats, beat) - 1, 0)]
+    def segment_at_time(self, t):
+        return self.segments[max(bisect_right(self.times, t) - 1, 0)]
+    def bpm_at(self, beat):
+        start_beat, start_time, bpm, end_bpm, ramp_beats = self.segment_at_beat(beat)
+        if ramp_beats == 0:
+            return bpm
+        return bpm + ((end_bpm - bpm) * min(beat - start_beat, ramp_beats) / ramp_beats)
+    def time_at(self, beat):
+        start_beat, start_time, bpm, end_bpm, ramp_beats = self.segment_at_beat(beat)
+        if ramp_beats == 0 or end_bpm == bpm:
+            return start_time + ((beat - start_beat) * 60 / bpm)
+        # time is the integral of 60/bpm over the beats, which for a linear ramp is a log
+        k = (end_bpm - bpm) / ramp_beats
+        return start_time + ((60 / k) * log((bpm + (k * (beat - start_beat))) / bpm))
+    def beat_at(self, t):
+        start_beat, start_time, bpm, end_bpm, ramp_beats = self.segment_at_time(t)
+        if ramp_beats == 0 or end_bpm == bpm:
+            return start_beat + ((t - start_time) * bpm / 60)
+        k = (end_bpm - bpm) / ramp_beats
+        return start_beat + (bpm * (exp(k * (t - start_time) / 60) - 1) / k)
+    def add_segment(self, beat, bpm, end_bpm, ramp_beats, t = None):
+        # replaces everything from beat onwards, including any ramps that were planned after it. t is when beat
+        # happens, by default when the map already had it
+        if t is None:
+            t = self.time_at(beat)
+        i = bisect_right(self.beats, beat)
+        if i > 0 and self.beats[i - 1] == beat:
+            i -= 1
+        del self.segments[i:]
+        self.segments.append((beat, t, bpm, end_bpm, ramp_beats))
+        self.index_segments()
+        if ramp_beats > 0:
+            # back to a steady tempo once the ramp's done
+            self.segments.append((beat + ramp_beats, self.time_at(beat + ramp_beats), end_bpm, end_bpm, 0))
+            self.index_segments()
+    def index_segments(self):
+        self.beats = [segment[0] for segment in self.segments]
+        self.times = [segment[1] for segment in self.segments]
+    def set_tempo(self, bpm, beat):
+        self.add_segment(beat, bpm, bpm, 0)
+    def ramp(self, bpm, beat, ramp_beats):
+        # go from whatever the tempo is at beat to bpm over ramp_beats beats
+        self.add_segment(beat, self.bpm_at(beat), bpm, ramp_beats)
+    def sync(self, beat, t, bpm):
+        # have beat happen at t and go on at bpm from there, for following another clock. t has to be after the
+        # start of the segment before, or it's moved up to it
+        i = bisect_right(self.beats, beat)
+        if i > 0 and self.beats[i - 1] == beat:
+            i -= 1
+        if i > 0:
+            t = max(t, self.times[i - 1])
+        self.add_segment(beat, bpm, bpm, 0, t)
+    def forget(self, beat):
+        # drop the segments that end before beat, for when nothing before it will be asked about again. without this
+        # following a clock, which adds a segment every beat, would grow the map for as long as it played
+        i = bisect_right(self.beats, beat) - 1
+        if i > 0:
+            del self.segments[:i]
+            self.index_segments()
+
+class Engine:
+    # a single long-lived clock thread. events are kept in a heap ordered by deadline (in engine time, see now())
+    # and the thread sleeps on a condition variable until the earliest one is due, so it idles instead of spinning.
+    # events can be scheduled at a time or at a beat, beats are turned into times by the tempo map and are moved
+    # when the tempo changes. note offs are kept in a heap of their own that the thread merges with the main one
+    def __init__(self, clock = time.perf_counter):
+        self.clock = clock
+        self.tempo = TempoMap(start_time = clock())
+        self.queue = [] # heap of (deadline, sequence number, beat or None, callback, args)
+        self.releases = [] # heap of note offs, the same as queue
+        self.counter = itertools.count() # tiebreaker so events at the same deadline keep their insertion order
+        self.condition = Condition()
+        self.running = False
+        self.thread = None
+        self.deadline = None # when the event whose callback is running was due, for callbacks that want to know how late they are
+        # what's being played, see play()
+        self.source = None
+        self.send = None
+        self.release = None # called to silence every note that's sounding, see play()
+        self.lookahead = 2
+        self.next_step = None # the first step pulled from source that was too far ahead to schedule yet
+        self.scheduled_up_to = -1 # beat of the last step scheduled from source
+    def now(self):
+        return self.clock()
+    def start(self):
+        with self.condition:
+            if self.running:
+                return
+            self.running = True
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+        # importing numpy for bursts takes long enough to make the start of a loop late if it's left until the first
+        # refill that needs it, but shouldn't hold up starting either
+        Thread(target=preload_bursts, daemon=True).start()
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+    def flush(self):
+        # drop everything that hasn't fired yet, and stop playing. like restart, the note offs that were queued are
+        # dropped too, so anything sounding is released
+        with self.condition:
+            self.queue.clear()
+            self.releases.clear()
+            self.release_voices()
+            self.source = None
+            self.next_step = None
+            self.condition.notify()
+    def schedule(self, deadline, callback, *args):
+        with self.condition:
+            self.push(deadline, None, callback, args)
+    def schedule_beat(self, beat, callback, *args):
+        with self.condition:
+            self.push(self.tempo.time_at(beat), beat, callback, args)
+    def push(self, deadline, beat, callback, args):
+        heapq.heappush(self.queue, (deadline, next(self.counter), beat, callback, args))
+        if self.queue[0][0] == deadline:
+            # new earliest event, the thread might be sleeping past it
+            self.condition.notify()
+    def push_release(self, deadline, beat, messages):
+        heapq.heappush(self.releases, (deadline, next(self.counter), beat, self.dispatch, (messages,)))
+        if self.releases[0][0] == deadline:
+            self.condition.notify()
+    def beat_at(self, t):
+        with self.condition:
+            return self.tempo.beat_at(t)
+    def time_at(self, beat):
+        with self.condition:
+            return self.tempo.time_at(beat)
+    def restart(self, bpm, start_time = None):
+        # drop everything queued, stop playing and start counting beats from 0 at start_time, by default now.
+        # the note offs that were queued are dropped too, so anything sounding is released
+        with self.condition:
+            self.queue.clear()
+            self.releases.clear()
+            self.release_voices()
+            self.source = None
+            self.next_step = None
+            self.scheduled_up_to = -1
+            self.tempo.reset(bpm, self.clock() if start_time is None else start_time)
+            self.condition.notify()
+    def play(self, source, send, lookahead = 2, release = None):
+        # source is an iterator of (beat, messages, bursts, releases) steps in order, like Loop.stream or
+        # Arrangement.stream, and send is called with each step's messages, all at once, and the time they were due,
+        # when it's due. each group of releases is sent its gate after the step, and bursts are split into hits
+        # that are sent the same way with their note offs. steps are pulled from source only as they come within
+        # lookahead seconds, so however long the source is the queue stays short. replaces whatever was being played
+        # before, anything already scheduled from it still plays. release is called with no arguments to silence
+        # whatever's sounding when playing restarts or the tempo changes, e.g. Output.release
+        with self.condition:
+            refilling = self.source is not None # if so there's a refill queued already, which will pick up the new source
+            self.source = source
+            self.send = send
+            self.release = release
+            self.lookahead = lookahead
+            self.next_step = None
+        if not refilling:
+            self.refill()
+    def refill(self):
+        # runs on the clock thread every quarter of the lookahead to schedule the next lot of steps
+        with self.condition:
+            if self.source is None:
+                return
+            horizon = self.tempo.beat_at(self.clock() + self.lookahead)
+            step = self.next_step
+            bursts = [] # every burst in the window, worked out together at the end
+            hits = 0
+            while hits < MAX_REFILL_HITS:
+                if step is None:
+                    step = next(self.source, None)
+                    if step is None: # run out
+                        self.source = None
+                        break
+                beat, messages, step_bursts, releases = step
+                if beat > horizon:
+                    break
+                if messages:
+                    self.push(self.tempo.time_at(beat), beat, self.dispatch, (messages,))
+                for gate, offs in releases:
+                    if offs: # transposing can leave none
+                        self.push_release(self.tempo.time_at(beat + gate), beat + gate, offs)
+                for port, message, burst, gate in step_bursts:
+                    bursts.append((beat, port, message, burst, gate))
+                    hits += burst[0]
+                self.scheduled_up_to = beat
+                step = None
+            if bursts:
+                from burst import schedule_hits # needs numpy, so only imported once there's a burst to play
+                ons, offs = schedule_hits(self.tempo, bursts)
+                for t, beat, messages in ons:
+                    self.push(t, beat, self.dispatch, (messages,))
+                for t, beat, messages in offs:
+                    self.push_release(t, beat, messages)
+            if self.source is None:
+                return
+            self.next_step = step
+            if hits >= MAX_REFILL_HITS:
+                # stopped short of the horizon, carry on straight after anything that's due now has gone out
+                self.push(self.clock(), None, self.refill, ())
+            else:
+                self.push(self.clock() + (self.lookahead / 4), None, self.refill, ())
+    def dispatch(self, messages):
+        # the deadline isn't passed in the event's args because retime() can move it after it's queued
+        self.send(messages, self.deadline)
+    def set_tempo(self, bpm, beat = None):
+        # change tempo from beat on, by default the current beat, so the phase of whatever's playing is kept
+        with self.condition:
+            if beat is None:
+                beat = self.tempo.beat_at(self.clock())
+            self.tempo.set_tempo(bpm, beat)
+            self.forget_tempo()
+            self.retime()
+            self.release_voices()
+    def ramp_tempo(self, bpm, ramp_beats, start_beat = None):
+        # ramp from the tempo at start_beat (by default the current beat) to bpm over ramp_beats beats
+        with self.condition:
+            if start_beat is None:
+                start_beat = self.tempo.beat_at(self.clock())
+            self.tempo.ramp(bpm, start_beat, ramp_beats)
+            self.forget_tempo()
+            self.retime()
+            self.release_voices()
+    def sync(self, beat, t, bpm):
+        # move the time base so beat happens at t with bpm from there on, e.g. to follow an external midi clock.
+        # unlike set_tempo it doesn't release anything, since it's meant to be done every beat
+        with self.condition:
+            self.tempo.sync(beat, t, bpm)
+            self.forget_tempo()
+            self.retime()
+    def forget_tempo(self):
+        # drop the tempo map before now and before anything queued by beat, which is all that's looked up in it.
+        # needs the lock held
+        beats = [beat for heap in (self.queue, self.releases) for deadline, n, beat, callback, args in heap if beat is not None]
+        self.tempo.forget(min(beats + [self.tempo.beat_at(self.clock())]))
+    def retime(self):
+        # move queued events that were scheduled by beat to match the tempo map. needs the lock held
+        self.queue = self.retimed(self.queue)
+        self.releases = self.retimed(self.releases)
+        self.condition.notify()
+    def retimed(self, heap):
+        heap = [(self.tempo.time_at(beat), n, beat, callback, args) if beat is not None else (deadline, n, beat, callback, args)
+                for deadline, n, beat, callback, args in heap]
+        heapq.heapify(heap)
+        return heap
+    def release_voices(self):
+        # needs the lock held
+        if self.release is not None:
+            self.release()
+    def pending(self):
+        with self.condition:
+            return len(self.queue) + len(self.releases)
+    def run(self):
+        with self.condition:
+            while self.running:
+                # the earliest of the two heaps, note offs first when they're due at the same time as something else
+                # so a note that's played again straight after it's released isn't cut off by the release
+                if self.releases and (not self.queue or self.releases[0][0] <= self.queue[0][0] + SIMULTANEOUS):
+                    heap = self.releases
+                elif self.queue:
+                    heap = self.queue
+                else:
+                    self.condition.wait()
+                    continue
+                wait = heap[0][0] - self.clock()
+                if wait > 0:
+                    self.condition.wait(wait)
+                    continue
+                self.deadline, _, _, callback, args = heapq.heappop(heap)
+                # don't hold the lock while the callback runs, so the ui can keep scheduling
+                self.condition.release()
+                try:
+                    callback(*args)
+                except Exception as e:
+                    print(repr(e))
+                finally:
+                    self.condition.acquire()
+
+def preload_bursts():
+    try:
+        import burst
+    except Exception as e:
+        print(repr(e))
@@ -0,0 +1,207 @@
+# the clock and midi output in a child process, so nothing the editor does (rendering, rebuilding the table) can hold
+# them up by holding the gil. the loop being played is shared with the child as a block of shared memory holding
+# its notes, one row of loop.length per track like Loop.steps, that the child's copy of the loop plays straight from.
+# edits write into it and send a small update over a queue saying which step to recompile, changes to the loop's
+# shape (tracks or length) send the whole loop again with a new block. timing measurements come back the same way,
+# the child records them into a TimingLog in shared memory.
+# times are time.perf_counter in both processes, which is the same clock system wide, so the editor can keep its own
+# copy of the tempo map for drawing the playhead by making the same tempo changes with the same times as the child
+
+import multiprocessing
+from multiprocessing import shared_memory
+import time
+from engine import Engine, TempoMap
+from loop import Loop, EMPTY
+from output import Output, midi_out
+from timing import TimingLog, buffer_size
+
+STOP = ('stop',)
+
+class EngineProcess:
+    # stands in for both Engine and Output in the editor
+    def __init__(self, make_port = midi_out, clock = time.perf_counter, timing_size = 65536):
+        self.make_port = make_port # passed to the child's Output, so it has to be picklable, e.g. a class or module level function
+        self.clock = clock
+        self.context = multiprocessing.get_context('spawn') # a fresh interpreter without the editor's pygame and threads
+        self.commands = self.context.Queue()
+        self.timing_memory = shared_memory.SharedMemory(create = True, size = buffer_size(timing_size))
+        self.timing = TimingLog(timing_size, self.timing_memory.buf)
+        self.tempo = TempoMap(start_time = clock())
+        self.lister = make_port() # just for listing ports
+        self.loop = None # the loop last given to play_loop, its edits are passed on to the child
+        self.steps = None # (shared memory, its notes, {track: offset of its row}) for self.loop
+        self.process = None
+    def start(self):
+        if self.process is not None:
+            return
+        self.process = self.context.Process(target = run_child, args = (self.commands, self.make_port, self.timing_memory.name, self.timing.size), daemon = True)
+        self.process.start()
+    def stop(self):
+        # stops the child, for both Engine.stop and Output.stop so it's fine to call twice. timing is kept
+        if self.process is None:
+            return
+        self.commands.put(STOP)
+        self.process.join()
+        self.process = None
+        if self.loop is not None:
+            self.loop.listeners.remove(self.edited)
+            self.loop = None
+        if self.steps is not None:
+            self.close_steps(unlink = True)
+        timing = self.timing
+        self.timing = timing.copy()
+        timing.release()
+        self.timing_memory.close()
+        self.timing_memory.unlink()
+    # engine
+    def now(self):
+        return self.clock()
+    def beat_at(self, t):
+        return self.tempo.beat_at(t)
+    def time_at(self, beat):
+        return self.tempo.time_at(beat)
+    def restart(self, bpm):
+        # stop playing and start counting beats from 0 now
+        start_time = self.clock()
+        self.tempo.reset(bpm, start_time)
+        self.commands.put(('restart', bpm, start_time))
+    def set_tempo(self, bpm):
+        beat = self.tempo.beat_at(self.clock())
+        self.tempo.set_tempo(bpm, beat)
+        self.tempo.forget(beat) # only ever asked about from now on
+        self.commands.put(('set_tempo', bpm, beat))
+    def ramp_tempo(self, bpm, ramp_beats, start_beat = None):
+        beat = self.tempo.beat_at(self.clock())
+        if start_beat is None:
+            start_beat = beat
+        self.tempo.ramp(bpm, start_beat, ramp_beats)
+        self.tempo.forget(beat)
+        self.commands.put(('ramp_tempo', bpm, ramp_beats, start_beat))
+    def play_loop(self, loop):
+        # play loop carrying on from the step after the last one played, so from the start after restart()
+        if self.loop is not loop:
+            if self.loop is not None:
+                self.loop.listeners.remove(self.edited)
+            loop.listeners.append(self.edited)
+            self.loop = loop
+        self.share_steps()
+        self.commands.put(('play',))
+    # output
+    def port_names(self):
+        return self.lister.get_ports()
+    def set_default(self, name):
+        self.commands.put(('set_default', name))
+    # sharing the loop
+    def share_steps(self):
+        # a new block of shared memory for the loop as it is now, sent along with the whole loop.
+        # the child frees the old block once it's moved on to the new one
+        loop = self.loop
+        tracks = list(loop.steps)
+        memory = shared_memory.SharedMemory(create = True, size = max(len(tracks) * loop.length, 1) * 2)
+        notes = memory.buf.cast('h')
+        rows = {}
+        for i, track in enumerate(tracks):
+            rows[track] = i * loop.length
+            notes[rows[track]:rows[track] + loop.length] = loop.steps[track]
+        if self.steps is not None:
+            self.close_steps(unlink = False)
+        self.steps = (memory, notes, rows)
+        self.commands.put(('load', loop.data(), memory.name, tracks))
+    def close_steps(self, unlink):
+        memory, notes, rows = self.steps
+        self.steps = None
+        notes.release()
+        memory.close()
+        if unlink:
+            try:
+                memory.unlink()
+            except FileNotFoundError:
+                pass # the child got there first
+    def edited(self, operation, *args):
+        # a Loop listener, see Loop.notify
+        if operation == 'write':
+            track, t, value = args
+            if t < self.loop.length:
+                memory, notes, rows = self.steps
+                notes[rows[track] + t] = EMPTY if value is None else value
+                self.commands.put(('write', track, t, value))
+        elif operation in ('set_route', 'set_burst', 'set_track_gate', 'set_gate'):
+            self.commands.put((operation, *args))
+        else: # the tracks or the length changed
+            self.share_steps()
+
+class Child:
+    # the child process's end: a real Engine and Output playing a Loop whose steps are rows of the shared memory
+    def __init__(self, commands, make_port, timing_name, timing_size):
+        self.commands_queue = commands
+        self.timing_memory = shared_memory.SharedMemory(timing_name)
+        self.output = Output(make_port = make_port, timing = TimingLog(timing_size, self.timing_memory.buf))
+        self.engine = Engine()
+        self.engine.start()
+        self.loop = None
+        self.steps = None # (shared memory, its notes) behind self.loop's steps
+        self.playing = False
+        self.commands = {'load': self.load, 'play': self.play, 'restart': self.restart, 'set_tempo': self.engine.set_tempo,
+                         'ramp_tempo': self.engine.ramp_tempo, 'write': self.write, 'set_route': self.set_route,
+                         'set_burst': self.set_burst, 'set_track_gate': self.set_track_gate, 'set_gate': self.set_gate,
+                         'set_default': self.output.set_default}
+    def run(self):
+        command = self.commands_queue.get()
+        while command != STOP:
+            try:
+                self.commands[command[0]](*command[1:])
+            except Exception as e:
+                print(repr(e))
+            command = self.commands_queue.get()
+        self.engine.stop()
+        self.output.stop()
+        if self.steps is not None:
+            self.free(self.loop, self.steps)
+        self.output.timing.release()
+        self.timing_memory.close()
+    def load(self, data, name, tracks):
+        memory = shared_memory.SharedMemory(name)
+        notes = memory.buf.cast('h')
+        loop = Loop.from_data(data)
+        # the same notes as the rows from_data made, so nothing needs compiling again
+        loop.steps = {track: notes[i * loop.length:(i + 1) * loop.length] for i, track in enumerate(tracks)}
+        old_loop, old_steps = self.loop, self.steps
+        self.loop, self.steps = loop, (memory, notes)
+        if self.playing:
+            self.play()
+        if old_steps is not None:
+            # nothing's reading the old rows any more, the engine let go of the old loop's stream in play()
+            self.free(old_loop, old_steps)
+    def free(self, loop, steps):
+        memory, notes = steps
+        for row in loop.steps.values():
+            row.release()
+        notes.release()
+        memory.close()
+        memory.unlink()
+    def play(self):
+        self.playing = True
+        self.engine.play(self.loop.stream(self.engine.scheduled_up_to + 1), self.output.send, release = self.output.release)
+    def restart(self, bpm, start_time):
+        self.playing = False
+        self.engine.restart(bpm, start_time)
+    def write(self, track, t, value):
+        # the note's already in the shared row. value is what was written, the row could have been written again
+        # since, so it's what says whether the note was cleared
+        if t < self.loop.length:
+            if value is None:
+                # these go with the note, as in Loop.write
+                self.loop.bursts[track].pop(t, None)
+                self.loop.note_gates[track].pop(t, None)
+            self.loop.compile_step(t)
+    def set_route(self, track, port, channel):
+        self.loop.set_route(track, port, channel)
+    def set_burst(self, track, t, burst):
+        self.loop.set_burst(track, t, burst)
+    def set_track_gate(self, track, gate):
+        self.loop.set_track_gate(track, gate)
+    def set_gate(self, track, t, gate):
+        self.loop.set_gate(track, t, gate)
+
+def run_child(commands, make_port, timing_name, timing_size):
+    Child(commands, make_port, timing_name, timing_size).run()
@@ -0,0 +1,121 @@
+# offline rendering of loops to standard midi files, as fast as the cpu allows instead of in real time through a port
+# usage: python export.py patterns/ -o stems/ --bpm 120 --repeats 4
+
+import argparse
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor
+from midiconstants import NOTE_OFF
+import projectfile
+
+TICKS_PER_BEAT = 480
+
+def variable_length(n):
+    # midi variable length quantity, 7 bits per byte with the top bit set on all but the last
+    out = bytearray([n & 0x7F])
+    n >>= 7
+    while n:
+        out.insert(0, (n & 0x7F) | 0x80)
+        n >>= 7
+    return bytes(out)
+
+def render_loop(loop, bpm = 120, repeats = 1, ticks_per_beat = TICKS_PER_BEAT):
+    # returns a type 0 standard midi file as bytes. each step lasts one beat, same as in the editor, and notes are
+    # released after their gate the same way too
+    step_ticks = ticks_per_beat
+    pass_ticks = loop.length * step_ticks
+    if any(burst[4] < 1 for step in loop.step_bursts for port, message, burst, gate in step):
+        # bursts that might not play make every pass different, so they're all rendered and written out as one
+        events = [event for i in range(repeats) for event in pass_events(loop, step_ticks, i * pass_ticks)]
+        pass_ticks *= repeats
+        repeats = min(repeats, 1)
+    else:
+        events = pass_events(loop, step_ticks)
+
+    # every pass through the loop is identical apart from the delta time of its first event, so encode one pass and repeat it
+    body = bytearray()
+    tick = events[0][0] if len(events) > 0 else 0 # the body starts after the first event, its deltas count from there
+    for event_tick, _, message in events[1:]:
+        body += variable_length(event_tick - tick) + message
+        tick = event_tick
+    track = bytearray()
+    title = loop.title.encode('utf-8')
+    track += b'\x00\xff\x03' + variable_length(len(title)) + title
+    track += b'\x00\xff\x51\x03' + int(60000000 / bpm).to_bytes(3, 'big')
+    if len(events) > 0 and repeats > 0:
+        first_tick, _, first_message = events[0]
+        track += variable_length(first_tick) + first_message + body
+        between = variable_length(pass_ticks - events[-1][0] + first_tick) + first_message + body
+        track += between * (repeats - 1)
+        end_delta = pass_ticks - events[-1][0]
+    else:
+        end_delta = pass_ticks * repeats
+    track += variable_length(end_delta) + b'\xff\x2f\x00'
+    header = b'MThd' + struct.pack('>IHHH', 6, 0, 1, ticks_per_beat)
+    return header + b'MTrk' + struct.pack('>I', len(track)) + bytes(track)
+
+def pass_events(loop, step_ticks, start_tick = 0):
+    # (tick, order, message) for one time through the loop, note offs sort before note ons on the same tick
+    # a note off is never later than the next step starts, so ending up at the same tick as a note on it goes first
+    events = []
+    for t in range(loop.length):
+        # everything goes in the one track, channels are kept. notes out of range can't be written to a file
+        for port, message in loop.messages_at_time(t):
+            if 0 <= message[1] < 128:
+                events.append((start_tick + (t * step_ticks), 1, bytes(message)))
+        for gate, offs in loop.releases_at_time(t):
+            for port, message in offs:
+                if 0 <= message[1] < 128:
+                    events.append((start_tick + round((t + gate) * step_ticks), 0, bytes(message)))
+    bursts = [(t, message, burst, gate) for t in range(loop.length) for port, message, burst, gate in loop.bursts_at_time(t) if 0 <= message[1] < 128]
+    if bursts:
+        from burst import burst_hits
+        hits = burst_hits([burst for t, message, burst, gate in bursts], [gate for t, message, burst, gate in bursts])
+        for i, (t, message, burst, gate) in enumerate(bursts):
+            for offset, off, velocity in hits[i]:
+                tick = start_tick + round((t + offset) * step_ticks)
+                off_tick = start_tick + round((t + off) * step_ticks)
+                if off_tick > tick: # otherwise it's too short to be written at this resolution
+                    events.append((tick, 1, bytes([message[0], message[1], velocity])))
+                    events.append((off_tick, 0, bytes([NOTE_OFF | (message[0] & 0x0F), message[1], 0])))
+    events.sort(key = lambda e: (e[0], e[1]))
+    return events
+
+def export_file(path, out_path, bpm = 120, repeats = 1):
+    loop = projectfile.load(path)
+    with open(out_path, 'wb') as file:
+        file.write(render_loop(loop, bpm = bpm, repeats = repeats))
+    return out_path
+
+def export_directory(directory, out_directory = None, bpm = 120, repeats = 1, jobs = None):
+    # convert every .bhmr and .bhmb file in directory using a pool of processes, returns the number converted
+    if out_directory is None:
+        out_directory = directory
+    os.makedirs(out_directory, exist_ok = True)
+    names = sorted(name for name in os.listdir(directory) if os.path.splitext(name)[1] in ('.bhmr', '.bhmb'))
+    converted = 0
+    with ProcessPoolExecutor(max_workers = jobs) as pool:
+        futures = {pool.submit(export_file, os.path.join(directory, name),
+                               os.path.join(out_directory, os.path.splitext(name)[0] + '.mid'), bpm, repeats): name for name in names}
+        for future, name in futures.items():
+            try:
+                future.result()
+                converted += 1
+            except Exception as e:
+                print(f'{name}: {e!r}')
+    return converted
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'render biohammer loops to standard midi files')
+    parser.add_argument('source', help = 'a .bhmr or .bhmb file or a directory of them')
+    parser.add_argument('-o', '--output', help = 'output file or directory, defaults to next to the source')
+    parser.add_argument('--bpm', type = float, default = 120)
+    parser.add_argument('--repeats', type = int, default = 1, help = 'how many times to play the loop')
+    parser.add_argument('-j', '--jobs', type = int, default = None, help = 'worker processes, defaults to one per cpu')
+    args = parser.parse_args()
+    if os.path.isdir(args.source):
+        n = export_directory(args.source, args.output, bpm = args.bpm, repeats = args.repeats, jobs = args.jobs)
+        print(f'exported {n} files')
+    else:
+        out_path = args.output if args.output is not None else os.path.splitext(args.source)[0] + '.mid'
+        print(export_file(args.source, out_path, bpm = args.bpm, repeats = args.repeats))
@@ -0,0 +1,288 @@
+# loop data for biohammer, kept separate from the editor so it can be used without a display
+
+from array import array
+import itertools
+import json
+import numpy as np
+from midiconstants import NOTE_ON, NOTE_OFF
+EMPTY = -1 # marks a step with no note in Loop.steps
+# a burst plays a step's note as a ratchet of several hits instead of once. it's a tuple of
+# (count, curve, start velocity, end velocity, probability): count hits spread over the step, bunched towards its end
+# if curve is less than 1 (speeding up) or its start if more than 1 (slowing down), with velocity going from start
+# to end, each hit played with the given probability. see burst.py for how they're turned into hits
+NO_BURST = (1, 1.0, 127, 127, 1.0)
+# how much of its step a note is held for before its note off, as a fraction of the step. each track has a gate
+# that can be overridden for particular steps. for a burst it's how much of the gap to the next hit each hit is held
+DEFAULT_GATE = 1.0
+MIN_GATE = 0.01
+revisions = itertools.count() # shared by every loop so a revision number identifies one state of one loop
+
+class Loop:
+    def __init__(self, length, tracks, title = None):
+        self.length = length
+        if title is None:
+            self.title = "[loop]"
+        else:
+            self.title = title
+        self.events = {} # {track: {t: note}}, sparse and kept past the end of the loop so shrinking then growing it loses nothing
+        self.routes = {} # {track: (port, channel)}, port is a port name or None for the default port
+        self.bursts = {} # {track: {t: burst}}, sparse like events, for the notes that are played as bursts
+        self.gates = {} # {track: gate}
+        self.note_gates = {} # {track: {t: gate}}, sparse like events, for notes with a different gate to their track's
+        # compiled form of events for playback: one array of notes per track with EMPTY where there's nothing,
+        # plus the notes and ready to send (port, midi message) pairs for each step so a lookup is a single index.
+        # notes with a burst go in step_bursts as (port, midi message, burst, gate) instead of in step_messages.
+        # step_releases has the note offs for step_messages as (gate, ((port, midi message), ...)), grouped by gate
+        # in order of gate
+        self.steps = {} # {track: array of length self.length}
+        self.step_notes = [()] * length
+        self.step_messages = [()] * length
+        self.step_bursts = [()] * length
+        self.step_releases = [()] * length
+        self.revision = next(revisions) # changes on every edit, so checking for unsaved work doesn't need to serialise anything
+        self.listeners = [] # called with (operation, *args) after every edit, see notify
+        for track in tracks:
+            self.add_track(track)
+        self.reset()
+    def events_at_time(self, t):
+        return self.step_notes[t % self.length]
+    def messages_at_time(self, t):
+        return self.step_messages[t % self.length]
+    def bursts_at_time(self, t):
+        return self.step_bursts[t % self.length]
+    def releases_at_time(self, t):
+        return self.step_releases[t % self.length]
+    def stream(self, start_beat = 0):
+        # (beat, messages, bursts, releases) for each step from start_beat on, forever, for Engine.play, with the step's
+        # step_messages, step_bursts and step_releases. one step is one beat. edits show up in what's played as soon as they're made
+        for beat in itertools.count(start_beat):
+            t = beat % self.length
+            yield beat, self.step_messages[t], self.step_bursts[t], self.step_releases[t]
+    def step(self):
+        self.player_head = (self.player_head + 1) % self.length
+        es = self.events_at_time(self.player_head)
+        return es
+    def set_length(self, l):
+        old_length = self.length
+        self.length = l
+        if l < old_length:
+            for row in self.steps.values():
+                del row[l:]
+            del self.step_notes[l:]
+            del self.step_messages[l:]
+            del self.step_bursts[l:]
+            del self.step_releases[l:]
+        else:
+            for track, row in self.steps.items():
+                row.extend(self.events[track].get(t, EMPTY) for t in range(old_length, l))
+            self.step_notes.extend([()] * (l - old_length))
+            self.step_messages.extend([()] * (l - old_length))
+            self.step_bursts.extend([()] * (l - old_length))
+            self.step_releases.extend([()] * (l - old_length))
+            for t in range(old_length, l):
+                self.compile_step(t)
+        self.reset()
+        self.notify('set_length', l)
+    def reset(self):
+        self.player_head = -1
+    def compile(self, columns = None):
+        # compile every step in one go, for when a whole loop has been loaded at once. columns is {track: (steps, notes)}
+        # with each track's steps and their notes as arrays, by default made from events, but arrays mapped straight
+        # out of a file (see projectfile.BinaryProject) can be passed in to skip that. rather than adding notes to their
+        # steps one at a time, each note is made into one number, ((step * tracks) + track) * 128 + note, and those are
+        # sorted with numpy, so each step's notes are a slice of them in track order. steps with a burst or a note with
+        # its own gate are left to compile_step
+        tracks = list(self.steps)
+        width = len(tracks) * 128 # numbers per step
+        keys = []
+        on = [] # note on for each track * 128 + note
+        off = []
+        made = {} # {(port, channel): (note ons, note offs)}, so each distinct message is only made once
+        gate_of = [] # gate of each track
+        special = set() # steps for compile_step
+        for i, track in enumerate(tracks):
+            gate_of.append(self.gates[track])
+            if columns is None:
+                events = self.events[track]
+                steps = np.fromiter(events.keys(), np.int64, len(events))
+                notes = np.fromiter(events.values(), np.int64, len(events))
+            else:
+                steps, notes = (np.asarray(column, np.int64) for column in columns[track])
+            # events past the end are kept for if the loop grows, but aren't played
+            kept = (steps >= 0) & (steps < self.length)
+            steps, notes = steps[kept], notes[kept]
+            np.frombuffer(self.steps[track], np.int16)[steps] = notes
+            keys.append(steps * width + i * 128 + notes)
+            route = self.routes[track]
+            if route not in made:
+                port, channel = route
+                made[route] = ([(port, (NOTE_ON | channel, note, 127)) for note in range(128)],
+                               [(port, (NOTE_OFF | channel, note, 0)) for note in range(128)])
+            on.extend(made[route][0])
+            off.extend(made[route][1])
+            special.update(t for t in itertools.chain(self.bursts[track], self.note_gates[track]) if 0 <= t < self.length)
+        keys = np.sort(np.concatenate(keys)) if keys else np.zeros(0, np.int64)
+        bounds = np.searchsorted(keys, np.arange(self.length + 1) * width).tolist()
+        cells = (keys % width).tolist() # track * 128 + note
+        notes = (keys & 127).tolist()
+        ons = list(map(on.__getitem__, cells))
+        offs = list(map(off.__getitem__, cells))
+        one_gate = len(set(gate_of)) <= 1
+        self.step_notes = [()] * self.length
+        self.step_messages = [()] * self.length
+        self.step_bursts = [()] * self.length
+        self.step_releases = [()] * self.length
+        for t in range(self.length):
+            a, b = bounds[t], bounds[t + 1]
+            if a == b or t in special:
+                continue
+            self.step_notes[t] = tuple(notes[a:b])
+            self.step_messages[t] = tuple(ons[a:b])
+            if one_gate:
+                self.step_releases[t] = ((gate_of[0], tuple(offs[a:b])),)
+            else:
+                releases = {} # {gate: [(port, note off)]}
+                for cell, released in zip(cells[a:b], offs[a:b]):
+                    releases.setdefault(gate_of[cell >> 7], []).append(released)
+                self.step_releases[t] = tuple((gate, tuple(offs)) for gate, offs in sorted(releases.items()))
+        for t in special:
+            self.compile_step(t)
+    def compile_step(self, t):
+        routed = [(self.routes[track], row[t], self.bursts[track].get(t), self.note_gates[track].get(t, self.gates[track]))
+                  for track, row in self.steps.items() if row[t] != EMPTY]
+        self.step_notes[t] = tuple(note for route, note, burst, gate in routed)
+        self.step_messages[t] = tuple((port, (NOTE_ON | channel, note, 127)) for (port, channel), note, burst, gate in routed if burst is None)
+        self.step_bursts[t] = tuple((port, (NOTE_ON | channel, note, 127), burst, gate) for (port, channel), note, burst, gate in routed if burst is not None)
+        releases = {}
+        for (port, channel), note, burst, gate in routed:
+            if burst is None:
+                releases.setdefault(gate, []).append((port, (NOTE_OFF | channel, note, 0)))
+        self.step_releases[t] = tuple((gate, tuple(offs)) for gate, offs in sorted(releases.items())) # in gate order, as compile has them
+    def write(self, track, t, value):
+        if value is None:
+            self.events[track].pop(t, None)
+            # these go with the note
+            self.bursts[track].pop(t, None)
+            self.note_gates[track].pop(t, None)
+        else:
+            value = int(value)
+            # checked before anything's changed, so a bad note leaves the loop as it was
+            if not 0 <= value < 128:
+                raise ValueError(f"{value} is not a midi note (0-127)")
+            self.events[track][t] = value
+        if t < self.length:
+            self.steps[track][t] = EMPTY if value is None else value
+            self.compile_step(t)
+        self.notify('write', track, t, value)
+    def add_track(self, name):
+        if name in self.events:
+            self.add_track(name + '+')
+        else:
+            self.events[name] = {}
+            self.routes[name] = (None, 0)
+            self.bursts[name] = {}
+            self.gates[name] = DEFAULT_GATE
+            self.note_gates[name] = {}
+            self.steps[name] = array('h', [EMPTY]) * self.length
+            self.notify('add_track', name)
+    def delete_track(self, track):
+        self.events.pop(track)
+        self.routes.pop(track)
+        self.bursts.pop(track)
+        self.gates.pop(track)
+        self.note_gates.pop(track)
+        row = self.steps.pop(track)
+        for t in range(self.length):
+            if row[t] != EMPTY:
+                self.compile_step(t)
+        self.notify('delete_track', track)
+        if len(self.events) == 0:
+            self.add_track('new track')
+    def set_route(self, track, port, channel):
+        # send track's notes to port (a port name, or None for the default) on channel (0-15)
+        self.routes[track] = (port, channel)
+        row = self.steps[track]
+        for t in range(self.length):
+            if row[t] != EMPTY:
+                self.compile_step(t)
+        self.notify('set_route', track, port, channel)
+    def set_burst(self, track, t, burst):
+        # burst is a tuple as described at NO_BURST, None or NO_BURST to play the note once as usual.
+        # it only does anything while there's a note at t, and is cleared along with the note
+        burst = None if burst is None or tuple(burst) == NO_BURST else tuple(burst)
+        if burst is None:
+            self.bursts[track].pop(t, None)
+        else:
+            self.bursts[track][t] = burst
+        if t < self.length:
+            self.compile_step(t)
+        self.notify('set_burst', track, t, None if burst is None else list(burst))
+    def set_track_gate(self, track, gate):
+        # the gate for track's notes that don't have their own, see DEFAULT_GATE
+        self.gates[track] = min(max(float(gate), MIN_GATE), 1.0)
+        row = self.steps[track]
+        for t in range(self.length):
+            if row[t] != EMPTY and t not in self.note_gates[track]:
+                self.compile_step(t)
+        self.notify('set_track_gate', track, self.gates[track])
+    def set_gate(self, track, t, gate):
+        # the gate for the note at t, or None to use the track's. like bursts it's cleared along with the note
+        if gate is None:
+            self.note_gates[track].pop(t, None)
+        else:
+            gate = self.note_gates[track][t] = min(max(float(gate), MIN_GATE), 1.0)
+        if t < self.length:
+            self.compile_step(t)
+        self.notify('set_gate', track, t, gate)
+    def notify(self, operation, *args):
+        # operation is the name of the method that made the edit and args are what it was called with,
+        # with add_track given the name the track actually ended up with
+        self.revision = next(revisions)
+        for listener in self.listeners:
+            listener(operation, *args)
+    def data(self):
+        # a copy of everything needed to save the loop, safe to hand to another thread
+        return {'title': self.title, 'length': self.length, 'tracks': {track: dict(events) for track, events in self.events.items()},
+                'routes': {track: list(route) for track, route in self.routes.items()},
+                'bursts': {track: {t: list(burst) for t, burst in bursts.items()} for track, bursts in self.bursts.items() if len(bursts) > 0},
+                'gates': {track: gate for track, gate in self.gates.items() if gate != DEFAULT_GATE},
+                'note_gates': {track: dict(gates) for track, gates in self.note_gates.items() if len(gates) > 0}}
+    def serialise(self):
+        # for saving purposes
+        return json.dumps(self.data())
+    def from_data(data):
+        events = {track: {int(index): int(value) for index, value in track_events.items()} for track, track_events in data['tracks'].items()}
+        # older files don't have routes, bursts or gates
+        routes = {track: (port, int(channel)) for track, (port, channel) in data.get('routes', {}).items()}
+        bursts = {track: {int(t): (int(count), float(curve), int(start), int(end), float(probability))
+                          for t, (count, curve, start, end, probability) in track_bursts.items()}
+                  for track, track_bursts in data.get('bursts', {}).items()}
+        gates = {track: float(gate) for track, gate in data.get('gates', {}).items()}
+        note_gates = {track: {int(t): float(gate) for t, gate in track_gates.items()} for track, track_gates in data.get('note_gates', {}).items()}
+        return Loop.from_events(data['length'], events, title = data['title'], routes = routes, bursts = bursts, gates = gates, note_gates = note_gates)
+    def from_events(length, events, title = None, routes = None, bursts = None, gates = None, note_gates = None, columns = None):
+        # build a loop from {track: {t: note}} in one go rather than writing each event separately.
+        # routes is {track: (port, channel)}, tracks not in it go to channel 0 of the default port.
+        # bursts is {track: {t: burst}}, gates is {track: gate} and note_gates is {track: {t: gate}}.
+        # columns is passed on to compile, for when the notes are already in arrays as well.
+        # raises ValueError if there's a note that isn't a midi note, as write does
+        for track, track_events in events.items():
+            if len(track_events) > 0 and not 0 <= min(track_events.values()) <= max(track_events.values()) < 128:
+                t, note = next((t, note) for t, note in track_events.items() if not 0 <= note < 128)
+                raise ValueError(f"{note} at step {t} of {track!r} is not a midi note (0-127)")
+        new_loop = Loop(length, events, title = title)
+        new_loop.events = events
+        if routes is not None:
+            new_loop.routes.update((track, route) for track, route in routes.items() if track in events)
+        if bursts is not None:
+            for track, track_bursts in bursts.items():
+                if track in events:
+                    new_loop.bursts[track] = {t: burst for t, burst in track_bursts.items() if t in events[track]}
+        if gates is not None:
+            new_loop.gates.update((track, gate) for track, gate in gates.items() if track in events)
+        if note_gates is not None:
+            for track, track_gates in note_gates.items():
+                if track in events:
+                    new_loop.note_gates[track] = {t: gate for t, gate in track_gates.items() if t in events[track]}
+        new_loop.compile(columns)
+        return new_loop
@@ -1,25 +1,50 @@
 # meatflower pygame gui system, built for the biohammer sequencer
 
 import pygame as pg
+from collections import OrderedDict
+import itertools
 
 class MeatflowerGui:
-    def __init__(self, resolution, scale = 10, fontsize = 24):
+    def __init__(self, resolution, scale = 10, fontsize = 24, text_cache_size = 4096):
         self.screen = pg.Surface(resolution)
-        self.elements = []
-        self.disabled_elements = []
+        # dicts used as insertion ordered sets, the values are the order elements were added in
+        # which is also the order they're drawn in
+        self.elements = {} # {elem: order}
+        self.disabled_elements = {} # {elem: None}
+        self.element_counter = itertools.count()
+        self.index = SpatialIndex(self.screen.get_rect())
+        self.dirty_rects = [] # areas left behind by removed or disabled elements that need repainting
+        self.changed = {} # elements that need repainting or refiling in the index since the last render
+        self.layout_pending = {} # top level containers whose layout needs redoing
         self.key_counter = 0
         self.selected_element = None
         self.font = pg.font.Font(None,fontsize)
         self.scale = scale
+        # rendered text surfaces shared by every element, most recently used last
+        self.text_cache = OrderedDict() # {(text, antialias, colour): surface}
+        self.text_cache_size = text_cache_size
+        self.text_cache_hits = 0
+        self.text_cache_misses = 0
+        # lines of text drawn on top of everything, see set_overlay
+        self.overlay = None
+        self.overlay_position = (0,0)
+        self.overlay_interval = 500
+        self.overlay_surfaces = []
+        self.overlay_rect = None
+        self.overlay_updated = None
     def add_element(self, elem_type, *args, **kwargs):
         e = elem_type(*args, gui = self, **kwargs)
-        self.elements.append(e)
+        self.elements[e] = next(self.element_counter)
+        self.index.insert(e)
         return e
     def remove_element(self, elem):
         if elem in self.elements:
             if self.selected_element == elem:
                 self.selected_element = None
-            self.elements.remove(elem)
+            del self.elements[elem]
+            self.index.remove(elem)
+            self.changed.pop(elem, None)
+            self.mark_dirty_rect(elem.drawn_rect)
             elem.destroy()
     def select_element(self, elem):
         if self.selected_element is not None:
@@ -29,39 +54,209 @@ class MeatflowerGui:
             self.selected_element.select()
     def disable_element(self, elem):
         if elem in self.elements:
-            self.elements.remove(elem)
-            self.disabled_elements.append(elem)
+            del self.elements[elem]
+            self.index.remove(elem)
+            self.disabled_elements[elem] = None
+            self.mark_dirty_rect(elem.drawn_rect)
     def enable_element(self, elem):
         if elem in self.disabled_elements:
-            self.disabled_elements.remove(elem)
-            self.elements.append(elem)
+            del self.disabled_elements[elem]
+            self.elements[elem] = next(self.element_counter)
+            self.index.insert(elem)
+            elem.mark_dirty()
+            if elem.needs_layout and elem.parent is None:
+                self.layout_pending[elem] = None
+    def render_text(self, text, antialias, colour):
+        # like self.font.render but cached. the surfaces are shared so nothing should draw onto them
+        key = (text, antialias, tuple(colour))
+        surface = self.text_cache.get(key)
+        if surface is None:
+            self.text_cache_misses += 1
+            surface = self.font.render(text, antialias, colour)
+            self.text_cache[key] = surface
+            if len(self.text_cache) > self.text_cache_size:
+                self.text_cache.popitem(last = False)
+        else:
+            self.text_cache_hits += 1
+            self.text_cache.move_to_end(key)
+        return surface
+    def text_cache_stats(self):
+        lookups = self.text_cache_hits + self.text_cache_misses
+        return {'hits': self.text_cache_hits, 'misses': self.text_cache_misses,
+                'hit_rate': self.text_cache_hits / lookups if lookups > 0 else 0,
+                'size': len(self.text_cache), 'max_size': self.text_cache_size}
+    def set_overlay(self, lines, position = (0,0), interval = 500):
+        # lines is a function returning a list of strings to show on top of everything else, e.g. stats. it's
+        # called at most every interval milliseconds since it may be slow. None takes the overlay away
+        self.mark_dirty_rect(self.overlay_rect)
+        self.overlay = lines
+        self.overlay_position = position
+        self.overlay_interval = interval
+        self.overlay_surfaces = []
+        self.overlay_rect = None
+        self.overlay_updated = None
+    def update_overlay(self):
+        now = pg.time.get_ticks()
+        if self.overlay_updated is not None and now - self.overlay_updated < self.overlay_interval:
+            return
+        self.overlay_updated = now
+        # not through render_text, the text changes all the time and would only push useful things out of the cache
+        self.overlay_surfaces = [self.font.render(line, True, (255,255,255)) for line in self.overlay()]
+        self.mark_dirty_rect(self.overlay_rect)
+        width = max([surface.get_width() for surface in self.overlay_surfaces], default = 0)
+        height = sum(surface.get_height() for surface in self.overlay_surfaces)
+        self.overlay_rect = pg.Rect(self.overlay_position, (width + (self.scale // 2), height + (self.scale // 2)))
+        self.mark_dirty_rect(self.overlay_rect)
+    def draw_overlay(self):
+        self.screen.fill((0,0,0), self.overlay_rect)
+        x, y = self.overlay_rect.left + (self.scale // 4), self.overlay_rect.top + (self.scale // 4)
+        for surface in self.overlay_surfaces:
+            self.screen.blit(surface, (x, y))
+            y += surface.get_height()
+    def next_update(self):
+        # milliseconds until render needs calling for something other than an event, or None if nothing's due
+        if self.overlay is None:
+            return None
+        if self.overlay_updated is None:
+            return 0
+        return max(self.overlay_interval - (pg.time.get_ticks() - self.overlay_updated), 0)
+    def mark_dirty_rect(self, rect):
+        if rect is not None:
+            self.dirty_rects.append(rect)
     def render(self):
+        # only repaint what changed since the last call. returns the changed rects so the caller can
+        # copy just those areas of self.screen and pass them to pg.display.update
+        if self.overlay is not None:
+            self.update_overlay()
+        pending = self.layout_pending
+        self.layout_pending = {}
+        for elem in pending:
+            if elem.parent is None and elem.needs_layout and elem in self.elements:
+                elem.update_layout()
+        dirty = self.dirty_rects
+        self.dirty_rects = []
+        changed = self.changed
+        self.changed = {}
+        for elem in changed:
+            if elem not in self.elements:
+                continue
+            self.index.update(elem)
+            if elem.paints:
+                if elem.drawn_rect is not None:
+                    dirty.append(elem.drawn_rect)
+                elem.drawn_rect = elem.rect.copy()
+                dirty.append(elem.drawn_rect)
+        if len(dirty) == 0:
+            return []
+        area = dirty[0].unionall(dirty[1:])
+        self.screen.set_clip(area)
         self.screen.fill((0,0,0))
-        for elem in self.elements:
-            elem.draw(self.screen)
-        return self.screen
+        for elem in self.in_draw_order(self.index.colliding(area)):
+            if elem.paints:
+                elem.draw(self.screen)
+        if self.overlay_rect is not None and self.overlay_rect.colliderect(area):
+            self.draw_overlay()
+        self.screen.set_clip(None)
+        if len(dirty) > 64:
+            # past a point one big update is cheaper than lots of small ones
+            return [area]
+        return dirty
     def at_point(self, point):
-        r = []
-        for elem in self.elements:
-            if elem.rect.collidepoint(point):
-                r.append(elem)
-        return r
+        return self.in_draw_order(self.index.at_point(point))
+    def in_draw_order(self, elems):
+        return sorted(elems, key = self.elements.__getitem__)
     def keypress(self, keyevent):
         if self.selected_element is not None:
             self.selected_element.keypress(keyevent)
 
+class SpatialIndex:
+    # uniform grid over element rects, so hit testing and finding what to repaint only looks at elements nearby
+    def __init__(self, bounds, cell_size = 64):
+        self.bounds = bounds # anything outside this can't be seen or clicked so isn't filed
+        self.cell_size = cell_size
+        self.cells = {} # {(x,y): {elem: None}}
+        self.rects = {} # {elem: the rect it's currently filed under}
+    def cells_for(self, rect):
+        cs = self.cell_size
+        rect = rect.clip(self.bounds)
+        return [(x, y) for x in range(rect.left // cs, ((rect.right - 1) // cs) + 1)
+                       for y in range(rect.top // cs, ((rect.bottom - 1) // cs) + 1)]
+    def insert(self, elem):
+        rect = elem.rect.copy()
+        self.rects[elem] = rect
+        for cell in self.cells_for(rect):
+            self.cells.setdefault(cell, {})[elem] = None
+    def remove(self, elem):
+        rect = self.rects.pop(elem, None)
+        if rect is None:
+            return
+        for cell in self.cells_for(rect):
+            bucket = self.cells[cell]
+            del bucket[elem]
+            if len(bucket) == 0:
+                del self.cells[cell]
+    def update(self, elem):
+        # refile elem if it's moved or changed size since it was last filed
+        old = self.rects[elem]
+        if old != elem.rect:
+            if not old.colliderect(self.bounds) and not elem.rect.colliderect(self.bounds):
+                self.rects[elem] = elem.rect.copy() # still offscreen, it's not in any cells
+                return
+            self.remove(elem)
+            self.insert(elem)
+    def at_point(self, point):
+        cell = (int(point[0]) // self.cell_size, int(point[1]) // self.cell_size)
+        return [elem for elem in self.cells.get(cell, ()) if elem.rect.collidepoint(point)]
+    def colliding(self, rect):
+        found = {}
+        for cell in self.cells_for(rect):
+            for elem in self.cells.get(cell, ()):
+                if elem not in found and elem.rect.colliderect(rect):
+                    found[elem] = None
+        return list(found)
+
 class BaseGuiElement:
+    # every element class has __slots__, there can be a lot of them so they're kept small
+    __slots__ = ('gui', 'rect', '_colour', 'selected', 'parent', 'drawn_rect')
+    paints = True # False for elements that only position others and never draw anything themselves
+    needs_layout = False # only ever True for containers
     def __init__(self, position, size, colour = (128,128,128), gui = None):
-        self.rect = pg.Rect(position, size)
-        self.colour = colour
-        self.selected = False
         if gui is None:
             raise Exception("gui element must have a parent gui supplied")
         self.gui = gui
+        self.rect = pg.Rect(position, size)
+        self._colour = colour
+        self.selected = False
+        self.parent = None # the container laying this out, if any
+        self.drawn_rect = None # where it was last painted, so moving or resizing repaints both places
+        self.mark_dirty()
+    def mark_dirty(self):
+        # needs repainting and refiling in the spatial index, call whenever anything that affects how or where it's drawn changes
+        self.gui.changed[self] = None
+    def move_to(self, x, y):
+        if self.rect.topleft != (x, y):
+            self.rect.topleft = (x, y)
+            self.mark_dirty()
+    def set_size(self, size):
+        if self.rect.size != tuple(size):
+            self.rect.size = size
+            self.mark_dirty()
+            if self.parent is not None:
+                self.parent.invalidate(self)
+    @property
+    def colour(self):
+        return self._colour
+    @colour.setter
+    def colour(self, colour):
+        if colour != self._colour:
+            self._colour = colour
+            self.mark_dirty()
     def select(self):
         self.selected = True
+        self.mark_dirty()
     def deselect(self):
         self.selected = False
+        self.mark_dirty()
     def keypress(self, keyevent):
         pass
     def clicked(self, pos):
@@ -79,11 +274,13 @@ class BaseGuiElement:
 
 
 class Cell(BaseGuiElement):
+    __slots__ = ('label_img',)
     def __init__(self, position, size, label, colour = (128,128,128), gui = None):
         super().__init__(position, size, colour = colour, gui = gui)
         self.set_label(label)
     def set_label(self, text):
-        self.label_img = self.gui.font.render(text, True, contrasting_colour(self.colour))
+        self.label_img = self.gui.render_text(text, True, contrasting_colour(self.colour))
+        self.mark_dirty()
     def draw(self, surface):
         pg.draw.rect(surface, self.colour, pg.Rect(self.rect.topleft, self.rect.size))
         if self.selected:
@@ -91,26 +288,38 @@ class Cell(BaseGuiElement):
         surface.blit(self.label_img, tuple_map(lambda a,b:a-b, self.rect.center, self.label_img.get_rect().center))
 
 class Text(BaseGuiElement):
+    __slots__ = ('text_img', 'text')
     def __init__(self, position, text, colour = (128,128,128), gui = None):
         super().__init__(position, (0,0), colour = colour, gui = gui)
         self.set_text(text)
     def set_text(self, text):
-        self.text_img = self.gui.font.render(text, True, contrasting_colour(self.colour))
-        self.rect.size = tuple_map(lambda a,b: a+b, self.text_img.get_size(), (self.gui.scale, self.gui.scale))
+        self.text_img = self.gui.render_text(text, True, contrasting_colour(self.colour))
         self.text = text
+        self.set_size(tuple_map(lambda a,b: a+b, self.text_img.get_size(), (self.gui.scale, self.gui.scale)))
+        self.mark_dirty()
     def draw(self, surface):
         pg.draw.rect(surface, self.colour, pg.Rect(self.rect.topleft, self.rect.size))
         surface.blit(self.text_img, tuple_map(lambda a,b:a-b, self.rect.center, self.text_img.get_rect().center))
 
 class EditableText(BaseGuiElement):
+    __slots__ = ('listeners', 'text', 'text_img', 'cursor')
     def __init__(self, position, default, colour = (128,128,128), gui = None):
         super().__init__(position, (0,0), colour = colour, gui = gui)
+        self.listeners = [] # called with the element whenever its text changes
+        self.text = None
         self.set_text(default)
         self.cursor = len(self.text)
     def set_text(self, text):
-        self.text_img = self.gui.font.render(text, True, contrasting_colour(self.colour))
-        self.rect.size = tuple_map(lambda a,b: a+b, self.text_img.get_size(), (self.gui.scale, self.gui.scale))
+        changed = text != self.text
+        self.text_img = self.gui.render_text(text, True, contrasting_colour(self.colour))
         self.text = text
+        self.set_size(tuple_map(lambda a,b: a+b, self.text_img.get_size(), (self.gui.scale, self.gui.scale)))
+        self.mark_dirty()
+        if changed:
+            self.notify()
+    def notify(self):
+        for listener in self.listeners:
+            listener(self)
     def draw(self, surface):
         pg.draw.rect(surface, self.colour, pg.Rect(self.rect.topleft, self.rect.size))
         text_position = tuple_map(lambda a,b:a-b, self.rect.center, self.text_img.get_rect().center)
@@ -122,6 +331,7 @@ class EditableText(BaseGuiElement):
                          (text_position[0] + text_size[0], text_position[1] + text_size[1]))
     def keypress(self, event):
         if event.type == pg.KEYDOWN:
+            self.mark_dirty() # at least the cursor will have moved
             if event.key == pg.K_LEFT:
                 if self.cursor > 0:
                     self.cursor -= 1
@@ -144,79 +354,281 @@ class EditableText(BaseGuiElement):
                 self.set_text(self.text[:self.cursor] + event.unicode + self.text[self.cursor:])
                 self.cursor += len(event.unicode)
 
-class Row(BaseGuiElement):
-    def __init__(self, position, children = [], padding = 1, colour = (0,0,0), gui = None):
+class Container(BaseGuiElement):
+    # Row, Column and Table don't draw anything, they just lay out their children.
+    # layout is cached and only redone when a child changes size or is swapped out, which also
+    # invalidates any containers this one is nested in
+    __slots__ = ('needs_layout', 'changed_children')
+    paints = False
+    def __init__(self, position, colour = (0,0,0), gui = None):
         super().__init__(position, (0,0), colour = colour, gui = gui)
-        self.children = children
-        self.padding = self.gui.scale * padding
+        self.needs_layout = False
+        self.changed_children = None # {child: None} for children resized since the last layout, None to redo everything
+        self.invalidate()
+    def all_children(self):
+        return self.children.values() if isinstance(self.children, dict) else self.children
+    def adopt(self, child):
+        child.parent = self
+        self.invalidate(child)
+    def invalidate(self, child = None):
+        if child is None:
+            self.changed_children = None
+        elif self.changed_children is not None:
+            self.changed_children[child] = None
+        if not self.needs_layout:
+            self.needs_layout = True
+            if self.parent is not None:
+                self.parent.invalidate(self)
+            else:
+                self.gui.layout_pending[self] = None
+    def update_layout(self):
+        changed = self.changed_children
+        for child in (self.all_children() if changed is None else changed):
+            if child.needs_layout:
+                child.update_layout()
+        self.arrange(None if changed is None else list(changed))
+        self.changed_children = {}
+        self.needs_layout = False
+    def arrange(self, changed):
+        # work out child offsets and our own size, then place the children. changed is the children
+        # whose size has changed, or None if everything has to be redone
+        pass
+    def place_children(self):
+        pass
+    def move_to(self, x, y):
+        if self.rect.topleft != (x, y):
+            self.rect.topleft = (x, y)
+            self.mark_dirty()
+            self.place_children()
+    def resize(self, size):
+        # our parent already knows, it was invalidated along with us
+        if self.rect.size != size:
+            self.rect.size = size
+            self.mark_dirty()
     def destroy(self):
-        for child in self.children.values():
+        for child in list(self.all_children()):
             self.gui.remove_element(child)
     def draw(self, surface):
+        pass
+
+class Row(Container):
+    __slots__ = ('children', 'padding', 'offsets')
+    def __init__(self, position, children = [], padding = 1, colour = (0,0,0), gui = None):
+        super().__init__(position, colour = colour, gui = gui)
+        self.children = children
+        self.padding = self.gui.scale * padding
+        self.offsets = []
+        for child in self.children:
+            self.adopt(child)
+    def set_child(self, index, child):
+        self.children[index] = child
+        self.adopt(child)
+    def arrange(self, changed):
         xpos = self.padding
-        self.rect.h = 0
+        h = 0
+        self.offsets = []
         for child in self.children:
-            child.rect.x = self.rect.x + xpos
-            child.rect.y = self.rect.y
+            self.offsets.append(xpos)
             xpos += child.rect.w
             xpos += self.padding
-            if child.rect.h > self.rect.h:
-                self.rect.h = child.rect.h
-        self.rect.w = xpos
+            if child.rect.h > h:
+                h = child.rect.h
+        self.resize((xpos, h))
+        self.place_children()
+    def place_children(self):
+        for child, xpos in zip(self.children, self.offsets):
+            child.move_to(self.rect.x + xpos, self.rect.y)
 
-class Column(BaseGuiElement):
+class Column(Container):
+    __slots__ = ('children', 'padding', 'offsets')
     def __init__(self, position, children = [], padding = 1, colour = (0,0,0), gui = None):
-        super().__init__(position, (0,0), colour = colour, gui = gui)
+        super().__init__(position, colour = colour, gui = gui)
         self.children = children
         self.padding = self.gui.scale * padding
-    def destroy(self):
-        for child in self.children.values():
-            self.gui.remove_element(child)
-    def draw(self, surface):
+        self.offsets = []
+        for child in self.children:
+            self.adopt(child)
+    def set_child(self, index, child):
+        self.children[index] = child
+        self.adopt(child)
+    def arrange(self, changed):
         ypos = self.padding
-        self.rect.w = 0
+        w = 0
+        self.offsets = []
         for child in self.children:
-            child.rect.x = self.rect.x
-            child.rect.y = self.rect.y + ypos
+            self.offsets.append(ypos)
             ypos += child.rect.h
             ypos += self.padding
-            if child.rect.w > self.rect.w:
-                self.rect.w = child.rect.w
-        self.rect.h = ypos
+            if child.rect.w > w:
+                w = child.rect.w
+        self.resize((w, ypos))
+        self.place_children()
+    def place_children(self):
+        for child, ypos in zip(self.children, self.offsets):
+            child.move_to(self.rect.x, self.rect.y + ypos)
 
-class Table(BaseGuiElement):
+class Table(Container):
+    __slots__ = ('table_size', 'children', 'keys', 'padding', 'cols', 'rows', 'col_offsets', 'row_offsets')
     def __init__(self, position, table_size, children = None, padding = 1, colour = (0,0,0), gui = None):
-        super().__init__(position, (0,0), colour = colour, gui = gui)
+        super().__init__(position, colour = colour, gui = gui)
         self.table_size = table_size # tuple, (cols, rows)
-        if children is None:
-            self.children = {} # {(x,y): elem}
-        else:
-            self.children = children
+        self.children = {} # {(x,y): elem}
+        self.keys = {} # {elem: (x,y)}
         self.padding = self.gui.scale * padding
-    def destroy(self):
-        for child in self.children.values():
-            self.gui.remove_element(child)
-    def draw(self, surface):
-        cols = [0] * self.table_size[0]
-        rows = [0] * self.table_size[1]
-        for (x,y),child in self.children.items():
-            if cols[x] < child.rect.w + self.padding:
-                cols[x] = child.rect.w + self.padding
-            if rows[y] < child.rect.h + self.padding:
-                rows[y] = child.rect.h + self.padding
-        for (x,y),child in self.children.items():
-            child.rect.x = self.rect.x + sum(cols[:x]) + (x*self.padding)
-            child.rect.y = self.rect.y + sum(rows[:y]) + (y*self.padding)
-        self.rect.w = sum(cols) + ((len(cols)-1)*self.padding)
-        self.rect.h = sum(rows) + ((len(rows)-1)*self.padding)
+        # cached layout: width of each column and height of each row (both including padding), and where each one starts
+        self.cols = []
+        self.rows = []
+        self.col_offsets = []
+        self.row_offsets = []
+        if children is not None:
+            for key, child in children.items():
+                self.set_child(key, child)
+    def set_child(self, key, child):
+        old = self.children.get(key)
+        if old is not None:
+            self.keys.pop(old, None)
+        self.children[key] = child
+        self.keys[child] = key
+        self.adopt(child)
+    def arrange(self, changed):
+        if changed is None or len(self.cols) != self.table_size[0] or len(self.rows) != self.table_size[1]:
+            self.cols = [0] * self.table_size[0]
+            self.rows = [0] * self.table_size[1]
+            for (x,y),child in self.children.items():
+                if self.cols[x] < child.rect.w + self.padding:
+                    self.cols[x] = child.rect.w + self.padding
+                if self.rows[y] < child.rect.h + self.padding:
+                    self.rows[y] = child.rect.h + self.padding
+            self.recalculate_offsets()
+            return
+        # only the columns and rows the changed children are in can have changed size
+        resized = False
+        for child in changed:
+            if child not in self.keys:
+                continue
+            x, y = self.keys[child]
+            col = max([c.rect.w for c in self.column(x)], default = -self.padding) + self.padding
+            row = max([c.rect.h for c in self.row(y)], default = -self.padding) + self.padding
+            if col != self.cols[x] or row != self.rows[y]:
+                self.cols[x] = col
+                self.rows[y] = row
+                resized = True
+        if resized:
+            self.recalculate_offsets()
+        else:
+            for child in changed:
+                if child in self.keys:
+                    self.place_child(self.keys[child], child)
+    def column(self, x):
+        return [self.children[(x,y)] for y in range(self.table_size[1]) if (x,y) in self.children]
+    def row(self, y):
+        return [self.children[(x,y)] for x in range(self.table_size[0]) if (x,y) in self.children]
+    def recalculate_offsets(self):
+        self.col_offsets = list(itertools.accumulate(self.cols, lambda total, w: total + w + self.padding, initial = 0))
+        self.row_offsets = list(itertools.accumulate(self.rows, lambda total, h: total + h + self.padding, initial = 0))
+        self.resize((sum(self.cols) + ((len(self.cols)-1)*self.padding), sum(self.rows) + ((len(self.rows)-1)*self.padding)))
+        self.place_children()
+    def place_child(self, key, child):
+        child.move_to(self.rect.x + self.col_offsets[key[0]], self.rect.y + self.row_offsets[key[1]])
+    def place_children(self):
+        if len(self.col_offsets) < self.table_size[0] or len(self.row_offsets) < self.table_size[1]:
+            return # not laid out yet
+        for key, child in self.children.items():
+            self.place_child(key, child)
+
 
+class ScrollGrid(Container):
+    # a view onto a grid of (columns, rows) cells too big to have a widget for every cell. only the cells that fit
+    # in view_size (in pixels) exist, as a pool that's reused when scrolling: bind_cell(cell, x, y) is called to make
+    # a cell show what's at grid position (x, y) whenever that changes, so the number of widgets depends only on the
+    # size of the view. make_cell() makes a new cell for the pool, every cell should be the same size, cell_size
+    __slots__ = ('view_size', 'grid_size', 'cell_size', 'make_cell', 'bind_cell', 'padding', 'scroll_position', 'children', 'keys')
+    def __init__(self, position, view_size, grid_size, cell_size, make_cell, bind_cell, padding = 0.5, colour = (0,0,0), gui = None):
+        super().__init__(position, colour = colour, gui = gui)
+        self.view_size = view_size
+        self.grid_size = grid_size
+        self.cell_size = cell_size
+        self.make_cell = make_cell
+        self.bind_cell = bind_cell
+        self.padding = self.gui.scale * padding
+        self.scroll_position = (0,0) # grid position of the top left cell in view
+        self.children = {} # {position in the view: cell}
+        self.keys = {} # {cell: position in the view}
+        self.fill_pool()
+    def view_cells(self):
+        # how many cells are in view across and down
+        pitch_x, pitch_y = self.cell_size[0] + self.padding, self.cell_size[1] + self.padding
+        return (min(max(int((self.view_size[0] + self.padding) // pitch_x), 1), self.grid_size[0]),
+                min(max(int((self.view_size[1] + self.padding) // pitch_y), 1), self.grid_size[1]))
+    def fill_pool(self):
+        # make or remove cells so there's exactly one per position in view, then bind them all
+        cols, rows = self.view_cells()
+        for key in [key for key in self.children if key[0] >= cols or key[1] >= rows]:
+            cell = self.children.pop(key)
+            del self.keys[cell]
+            self.gui.remove_element(cell)
+        for x in range(cols):
+            for y in range(rows):
+                if (x, y) not in self.children:
+                    cell = self.make_cell()
+                    self.children[(x, y)] = cell
+                    self.keys[cell] = (x, y)
+                    self.adopt(cell)
+        self.scroll_to(*self.scroll_position, force = True)
+        self.invalidate()
+    def set_grid_size(self, grid_size):
+        if grid_size != self.grid_size:
+            self.grid_size = grid_size
+            self.fill_pool()
+    def set_view_size(self, view_size):
+        if view_size != self.view_size:
+            self.view_size = view_size
+            self.fill_pool()
+    def scroll_to(self, x, y, force = False):
+        # x and y are clamped so the view is always full, unless the grid is smaller than it
+        cols, rows = self.view_cells()
+        position = (min(max(x, 0), self.grid_size[0] - cols), min(max(y, 0), self.grid_size[1] - rows))
+        if position != self.scroll_position or force:
+            self.scroll_position = position
+            self.refresh()
+    def scroll(self, dx, dy):
+        self.scroll_to(self.scroll_position[0] + dx, self.scroll_position[1] + dy)
+    def refresh(self, x = None, y = None):
+        # rebind the cells in view showing grid column x and/or row y, or all of them
+        sx, sy = self.scroll_position
+        for (vx, vy), cell in self.children.items():
+            if (x is None or vx + sx == x) and (y is None or vy + sy == y):
+                self.bind_cell(cell, vx + sx, vy + sy)
+    def cell_at(self, x, y):
+        # the cell showing grid position (x, y), or None if it's out of view
+        return self.children.get((x - self.scroll_position[0], y - self.scroll_position[1]))
+    def grid_position(self, cell):
+        vx, vy = self.keys[cell]
+        return (vx + self.scroll_position[0], vy + self.scroll_position[1])
+    def arrange(self, changed):
+        # cells have fixed places, so a cell changing size never moves anything else
+        if changed is None:
+            cols, rows = self.view_cells()
+            self.resize((max((cols * (self.cell_size[0] + self.padding)) - self.padding, 0),
+                         max((rows * (self.cell_size[1] + self.padding)) - self.padding, 0)))
+            self.place_children()
+        else:
+            for cell in changed:
+                if cell in self.keys:
+                    self.place_child(self.keys[cell], cell)
+    def place_child(self, key, cell):
+        cell.move_to(self.rect.x + (key[0] * (self.cell_size[0] + self.padding)), self.rect.y + (key[1] * (self.cell_size[1] + self.padding)))
+    def place_children(self):
+        for key, cell in self.children.items():
+            self.place_child(key, cell)
 
 class Menu(BaseGuiElement):
+    __slots__ = ('options',)
     def __init__(self, position, options, colour = (128,128,128), gui = None):
         super().__init__(position, (0,0), colour = colour, gui = gui)
-        self.options = {option: self.gui.font.render(option, True, contrasting_colour(self.colour)) for option in options}
-        self.rect.w = max([option.get_size()[0] for option in self.options.values()])
-        self.rect.h = sum([option.get_size()[1] for option in self.options.values()])
+        self.options = {option: self.gui.render_text(option, True, contrasting_colour(self.colour)) for option in options}
+        self.set_size((max([option.get_size()[0] for option in self.options.values()]),
+                       sum([option.get_size()[1] for option in self.options.values()])))
     def clicked(self, pos):
         ypos = 0
         for text,option in self.options.items():
@@ -234,26 +646,33 @@ class Menu(BaseGuiElement):
 
 
 class Dropdown(BaseGuiElement):
+    __slots__ = ('listeners', 'value', 'options')
     def __init__(self, position, options, colour = (128,128,128), gui = None):
         super().__init__(position, (0,0), colour = colour, gui = gui)
+        self.listeners = [] # called with the element whenever its value changes
         self.value = options[0]
-        self.options = {option: self.gui.font.render(option, True, contrasting_colour(self.colour)) for option in options}
-        self.rect.size = tuple_map(lambda a,b: a+b, self.gui.font.size(self.value), (self.gui.scale, self.gui.scale))
+        self.options = {option: self.gui.render_text(option, True, contrasting_colour(self.colour)) for option in options}
+        self.set_size(tuple_map(lambda a,b: a+b, self.gui.font.size(self.value), (self.gui.scale, self.gui.scale)))
     def select(self):
         super().select()
-        self.rect.w = max([option.get_size()[0] for option in self.options.values()])
-        self.rect.h = sum([option.get_size()[1] for option in self.options.values()])
+        self.set_size((max([option.get_size()[0] for option in self.options.values()]),
+                       sum([option.get_size()[1] for option in self.options.values()])))
     def deselect(self):
         super().deselect()
-        self.rect.size = tuple_map(lambda a,b: a+b, self.gui.font.size(self.value), (self.gui.scale, self.gui.scale))
+        self.set_size(tuple_map(lambda a,b: a+b, self.gui.font.size(self.value), (self.gui.scale, self.gui.scale)))
     def clicked(self, pos):
         ypos = 0
         for text,option in self.options.items():
             option_rect = option.get_rect()
-            if pg.Rect((self.rect.x, self.rect.y + ypos), (self.rect.w, option_rect.h)).collidepoint(pos):
+            if pg.Rect((self.rect.x, self.rect.y + ypos), (self.rect.w, option_rect.h)).collidepoint(pos) and text != self.value:
                 self.value = text
+                self.mark_dirty()
+                self.notify()
             ypos += option_rect.h
         self.deselect()
+    def notify(self):
+        for listener in self.listeners:
+            listener(self)
     def draw(self, surface):
         pg.draw.rect(surface, self.colour, self.rect)
         if self.selected:
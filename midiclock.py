@@ -0,0 +1,129 @@
+# midi clock: sending 24 pulses per beat with start, stop and continue so other gear can follow biohammer, and
+# following another device's clock by feeding a smoothed estimate of its tempo and phase into the engine's tempo map
+
+from collections import deque
+from math import ceil
+from midiconstants import TIMING_CLOCK, SONG_START, SONG_CONTINUE, SONG_STOP, SONG_POSITION_POINTER
+
+PPQN = 24 # clock pulses per beat
+WINDOW = 2 * PPQN # pulses the tempo estimate is fitted over
+GAP = 0.5 # seconds without a pulse after which the clock's taken to have stopped and the estimate starts again
+
+def midi_in():
+    # a real rtmidi.MidiIn, the default make_port for ClockIn
+    import rtmidi
+    return rtmidi.MidiIn()
+
+class ClockOut:
+    # pulses are scheduled on the engine by beat like notes, so they follow tempo changes, and go out through send
+    # (e.g. Output.send) so they're timed and batched with the notes. each pulse schedules the next, so there's only
+    # ever one waiting. Engine.restart drops it, so call start() again after restarting
+    def __init__(self, engine, send, port = None):
+        self.engine = engine
+        self.send = send
+        self.port = port # where to send it, None for the default port
+        self.generation = 0 # bumped by start, resume and stop so pulses from before are ignored
+    def start(self, beat = 0):
+        # start at beat, which the engine counts as the start of the song
+        self.generation += 1
+        self.engine.schedule_beat(beat, self.message, self.generation, (SONG_START,))
+        self.engine.schedule_beat(beat, self.pulse, self.generation, round(beat * PPQN))
+    def resume(self, beat):
+        # carry on from the first sixteenth at or after beat: where to first, then continue and pulses from there
+        self.generation += 1
+        sixteenths = ceil(beat * 4)
+        self.send(((self.port, (SONG_POSITION_POINTER, sixteenths & 0x7F, (sixteenths >> 7) & 0x7F)),))
+        self.engine.schedule_beat(sixteenths / 4, self.message, self.generation, (SONG_CONTINUE,))
+        self.engine.schedule_beat(sixteenths / 4, self.pulse, self.generation, sixteenths * PPQN // 4)
+    def stop(self):
+        self.generation += 1
+        self.send(((self.port, (SONG_STOP,)),))
+    def message(self, generation, message):
+        if generation == self.generation:
+            self.send(((self.port, message),), self.engine.deadline)
+    def pulse(self, generation, n):
+        # n counts pulses from beat 0
+        if generation != self.generation:
+            return
+        self.send(((self.port, (TIMING_CLOCK,)),), self.engine.deadline)
+        self.engine.schedule_beat((n + 1) / PPQN, self.pulse, generation, n + 1)
+
+class ClockIn:
+    # follows the clock coming in on the midi input port called name. the time of each pulse is taken when it arrives,
+    # on the engine's clock, and a line is fitted through the last WINDOW of them, which smooths out jitter in the
+    # sender and the driver. on every beat while the clock's running the engine's tempo map is moved onto the line
+    # with Engine.sync. on_start(time), on_continue(beat, time) and on_stop() are called from the port's thread when
+    # the clock starts (at its first pulse), continues (at its first pulse, from the beat given by a song position
+    # if there was one) or stops
+    def __init__(self, engine, name, make_port = midi_in, on_start = None, on_continue = None, on_stop = None):
+        self.engine = engine
+        self.on_start = on_start
+        self.on_continue = on_continue
+        self.on_stop = on_stop
+        self.pulses = deque(maxlen = WINDOW) # (pulse count, time) of the latest pulses
+        self.count = 0 # pulses ever received, so the fit doesn't care about starts and stops
+        self.position = 0 # pulses since the start of the song
+        self.running = False
+        self.starting = None # 'start' or 'continue' until the first pulse after one of them
+        self.port = make_port()
+        self.port.open_port(self.port.get_ports().index(name), name = 'biohammer')
+        self.port.ignore_types(sysex = True, timing = False, active_sense = True)
+        self.port.set_callback(self.received)
+    def close(self):
+        self.port.cancel_callback()
+        self.port.close_port()
+    def received(self, event, data = None):
+        (message, delta) = event
+        try:
+            self.handle(message, self.engine.now())
+        except Exception as e:
+            print(repr(e))
+    def handle(self, message, t):
+        status = message[0]
+        if status == TIMING_CLOCK:
+            self.pulse(t)
+        elif status == SONG_START:
+            self.position = 0
+            self.starting = 'start'
+        elif status == SONG_CONTINUE:
+            self.starting = 'continue'
+        elif status == SONG_POSITION_POINTER:
+            self.position = (message[1] | (message[2] << 7)) * PPQN // 4
+        elif status == SONG_STOP:
+            self.running = False
+            self.starting = None
+            if self.on_stop is not None:
+                self.on_stop()
+    def pulse(self, t):
+        if self.pulses and t - self.pulses[-1][1] > GAP:
+            self.pulses.clear()
+        self.pulses.append((self.count, t))
+        self.count += 1
+        if self.starting is not None:
+            starting, self.starting = self.starting, None
+            self.running = True
+            if starting == 'start' and self.on_start is not None:
+                self.on_start(t)
+            elif starting == 'continue' and self.on_continue is not None:
+                self.on_continue(self.position / PPQN, t)
+        elif self.running:
+            self.position += 1
+            if self.position % PPQN == 0 and len(self.pulses) >= PPQN:
+                period, first = self.fit(self.pulses)
+                latest = first + (period * (self.count - 1 - self.pulses[0][0])) # where the line has this pulse
+                self.engine.sync(self.position // PPQN, latest, 60 / (period * PPQN))
+    def fit(self, pulses):
+        # least squares line through pulses: (seconds per pulse, time of the first one on the line)
+        n = len(pulses)
+        start = pulses[0][0]
+        mean_x = sum(count - start for count, t in pulses) / n
+        mean_y = sum(t for count, t in pulses) / n
+        spread = sum((count - start - mean_x) ** 2 for count, t in pulses)
+        period = sum((count - start - mean_x) * (t - mean_y) for count, t in pulses) / spread
+        return period, mean_y - (period * mean_x)
+    def bpm(self):
+        # the estimated tempo, or None until there have been enough pulses. safe to call from any thread
+        pulses = list(self.pulses) # a copy, since the port's thread could be adding to it
+        if len(pulses) < PPQN:
+            return None
+        return 60 / (self.fit(pulses)[0] * PPQN)
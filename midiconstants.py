@@ -0,0 +1,15 @@
+# the midi status bytes and controllers biohammer uses, the same as rtmidi.midiconstants. they're defined here
+# rather than imported from there because that loads rtmidi's native library, which needs alsa, and everything but
+# real ports has to work without it
+
+NOTE_OFF = 0x80
+NOTE_ON = 0x90
+CONTROL_CHANGE = 0xB0
+ALL_NOTES_OFF = 0x7B # controller number
+
+# system real time and common, for midi clock
+SONG_POSITION_POINTER = 0xF2
+TIMING_CLOCK = 0xF8
+SONG_START = 0xFA
+SONG_CONTINUE = 0xFB
+SONG_STOP = 0xFC
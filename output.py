@@ -0,0 +1,230 @@
+# midi output for biohammer. one worker thread owns every port: it opens them, closes them and does all the sending,
+# taking jobs off a queue, so neither the clock thread nor the ui ever waits on a port
+
+import queue
+import time
+from threading import Thread
+from midiconstants import NOTE_ON, NOTE_OFF, CONTROL_CHANGE, ALL_NOTES_OFF
+from timing import TimingLog
+
+STOP = ('stop', None)
+
+def midi_out():
+    # a real rtmidi.MidiOut, the default make_port
+    import rtmidi
+    return rtmidi.MidiOut()
+
+class Output:
+    # messages are (port, message) pairs where port is a port name, or None for the default port.
+    # ports are opened the first time something is sent to them if they weren't opened already. when each message was
+    # due and when it was actually sent are recorded in self.timing, clock has to be the same one the engine uses.
+    # the notes that are sounding are tracked in self.voices so they can be released when playing stops, or when
+    # the default port changes and their note offs would go somewhere else
+    def __init__(self, make_port = midi_out, clock = time.perf_counter, timing = None):
+        self.make_port = make_port # anything with the MidiOut methods, so a stand in like NullPort can be used without real ports
+        self.clock = clock
+        self.timing = TimingLog() if timing is None else timing
+        self.ports = {} # {name: MidiOut, or None if it couldn't be opened}, only touched by the worker
+        self.voices = Voices() # only touched by the worker
+        self.default = None # name of the port that messages with port None go to
+        self.lister = make_port() # just for listing ports, from whichever thread asks
+        self.queue = queue.SimpleQueue()
+        self.thread = Thread(target = self.run, daemon = True)
+        self.thread.start()
+    def port_names(self):
+        return self.lister.get_ports()
+    def send(self, messages, deadline = None):
+        # send a step's messages, all together. doesn't block so it's safe to call from the clock thread
+        self.queue.put(('send', (messages, deadline)))
+    def open(self, name):
+        self.queue.put(('open', name))
+    def close(self, name):
+        self.queue.put(('close', name))
+    def set_default(self, name):
+        self.queue.put(('default', name))
+    def release(self, name = None):
+        # silence every note sounding on port name, or on every port if it's None
+        self.queue.put(('release', name))
+    def stop(self):
+        self.queue.put(STOP)
+        self.thread.join()
+    def run(self):
+        job = self.queue.get()
+        while job is not STOP:
+            operation, arg = job
+            job = None
+            if operation == 'send':
+                batch = [arg]
+                # anything else waiting to be sent is due by now too, so it all goes out back to back
+                while True:
+                    try:
+                        job = self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if job[0] != 'send':
+                        break
+                    batch.append(job[1])
+                    job = None
+                for messages, deadline in batch:
+                    self.send_now(messages, deadline)
+            elif operation == 'open':
+                self.open_now(arg, retry = True)
+            elif operation == 'close':
+                self.close_now(arg)
+            elif operation == 'default':
+                if self.default is not None and arg != self.default:
+                    self.release_now(self.default)
+                self.default = arg
+                self.open_now(arg, retry = True)
+            elif operation == 'release':
+                self.release_now(arg)
+            if job is None:
+                job = self.queue.get()
+        self.release_now(None)
+        for name in list(self.ports):
+            self.close_now(name)
+    def send_now(self, messages, deadline = None):
+        for port, message in messages:
+            name = self.default if port is None else port
+            if name not in self.ports:
+                self.open_now(name)
+            out = self.ports[name]
+            if out is not None:
+                try:
+                    out.send_message(message)
+                    if deadline is not None:
+                        self.timing.record(deadline, self.clock())
+                    self.voices.sent(name, message)
+                except Exception as e:
+                    print(repr(e))
+    def release_now(self, name):
+        for port, message in self.voices.release(name):
+            out = self.ports.get(port)
+            if out is not None:
+                try:
+                    out.send_message(message)
+                except Exception as e:
+                    print(repr(e))
+    def open_now(self, name, retry = False):
+        # a port that couldn't be opened is remembered as None so sending to it doesn't keep trying, unless retry
+        if self.ports.get(name) is not None or (name in self.ports and not retry):
+            return
+        self.ports[name] = None
+        if name is None:
+            return
+        try:
+            out = self.make_port()
+            out.open_port(out.get_ports().index(name), name = 'biohammer')
+            self.ports[name] = out
+        except Exception as e:
+            print(repr(e))
+    def close_now(self, name):
+        out = self.ports.pop(name, None)
+        if out is not None:
+            try:
+                out.close_port()
+            except Exception as e:
+                print(repr(e))
+
+class Voices:
+    # which notes are sounding on each port and channel, going by the note ons and offs that have been sent
+    def __init__(self):
+        self.sounding = {} # {(port name, channel): set of notes}
+    def sent(self, name, message):
+        kind = message[0] & 0xF0
+        if kind == NOTE_ON and message[2] > 0:
+            self.sounding.setdefault((name, message[0] & 0x0F), set()).add(message[1])
+        elif kind == NOTE_OFF or kind == NOTE_ON: # a note on with velocity 0 is a note off
+            notes = self.sounding.get((name, message[0] & 0x0F))
+            if notes is not None:
+                notes.discard(message[1])
+    def release(self, name = None):
+        # forgets the notes sounding on port name, or every port if it's None, and returns [(port name, message)] that
+        # silences them: a note off for each and then all notes off on each channel, for anything that missed one
+        messages = []
+        for (port, channel), notes in list(self.sounding.items()):
+            if name is None or port == name:
+                del self.sounding[(port, channel)]
+                if notes:
+                    messages += [(port, (NOTE_OFF | channel, note, 0)) for note in sorted(notes)]
+                    messages.append((port, (CONTROL_CHANGE | channel, ALL_NOTES_OFF, 0)))
+        return messages
+
+class NullPort:
+    # stand in for rtmidi.MidiOut that sends nowhere, for measuring timing on machines without midi
+    def __init__(self):
+        self.sent = 0
+    def get_ports(self):
+        return ['null']
+    def open_port(self, port = 0, name = None):
+        return self
+    def close_port(self):
+        pass
+    def send_message(self, message):
+        self.sent += 1
+
+class Loopback:
+    # a stand in midi cable for testing without real ports: whatever's sent through an out port made by make_out
+    # arrives at every open in port made by make_in, straight away on the sending thread like a driver's callback.
+    # the ports have the rtmidi.MidiOut and rtmidi.MidiIn methods biohammer uses, so make_out and make_in can be
+    # passed as make_port to Output and midiclock.ClockIn
+    def __init__(self, name = 'loopback', clock = time.perf_counter):
+        self.name = name
+        self.clock = clock
+        self.ins = []
+    def make_out(self):
+        return LoopbackOut(self)
+    def make_in(self):
+        return LoopbackIn(self)
+
+class LoopbackOut:
+    def __init__(self, loopback):
+        self.loopback = loopback
+    def get_ports(self):
+        return [self.loopback.name]
+    def open_port(self, port = 0, name = None):
+        return self
+    def close_port(self):
+        pass
+    def send_message(self, message):
+        now = self.loopback.clock()
+        for port in list(self.loopback.ins):
+            port.receive(list(message), now)
+
+class LoopbackIn:
+    def __init__(self, loopback):
+        self.loopback = loopback
+        self.callback = None
+        self.data = None
+        self.last = None # when the last message arrived, for the delta times rtmidi gives
+        self.pending = queue.SimpleQueue() # for get_message when there's no callback
+        self.ignoring = (0xF0, 0xF8, 0xFE) # what rtmidi ignores by default: sysex, timing and active sensing
+    def get_ports(self):
+        return [self.loopback.name]
+    def open_port(self, port = 0, name = None):
+        self.loopback.ins.append(self)
+        return self
+    def close_port(self):
+        if self in self.loopback.ins:
+            self.loopback.ins.remove(self)
+    def ignore_types(self, sysex = True, timing = True, active_sense = True):
+        self.ignoring = tuple(status for status, ignored in ((0xF0, sysex), (0xF8, timing), (0xFE, active_sense)) if ignored)
+    def set_callback(self, callback, data = None):
+        self.callback = callback
+        self.data = data
+    def cancel_callback(self):
+        self.callback = None
+    def get_message(self):
+        try:
+            return self.pending.get_nowait()
+        except queue.Empty:
+            return None
+    def receive(self, message, now):
+        if message[0] in self.ignoring:
+            return
+        delta = 0.0 if self.last is None else now - self.last
+        self.last = now
+        if self.callback is not None:
+            self.callback((message, delta), self.data)
+        else:
+            self.pending.put((message, delta))
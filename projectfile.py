@@ -0,0 +1,221 @@
+# saving and loading loops. json (.bhmr) is the original format and is still supported, there's also a compact
+# binary format (.bhmb) that can be memory mapped so the step data is used straight out of the file without copying
+#
+# binary layout, all little endian, every section padded to a multiple of 4 bytes:
+#   header: magic 'BHMB', version u16, flags u16 (unused), loop length u32, track count u32, title size u32
+#   title: utf-8
+#   track table: for each track, name size u32, event count u32, port name size u32 (NO_PORT for the default port)
+#     and channel u32, followed by the name and then the port name in utf-8. version 1 files have only the name size
+#     and event count, and everything goes to channel 0 of the default port
+#   step data: for each track in the same order, its steps as u32[event count] then its notes as i16[event count]
+#   burst data (version 3 on): for each track in the same order, burst count u32, then the steps with bursts as
+#     u32[burst count], then count, curve, start velocity, end velocity and probability of each as f32[burst count * 5]
+#   gate data (version 4 on): for each track in the same order, its gate f32, the count of notes with their own gate
+#     u32, then the steps of those notes as u32[count] and their gates as f32[count]
+
+from array import array
+import json
+import mmap
+import os
+import struct
+import sys
+from loop import Loop, DEFAULT_GATE
+
+MAGIC = b'BHMB'
+VERSION = 4
+HEADER = struct.Struct('<4sHHIII')
+TRACK_ENTRY_V1 = struct.Struct('<II')
+TRACK_ENTRY = struct.Struct('<IIII')
+NO_PORT = 0xFFFFFFFF
+
+def padded(n):
+    return (n + 3) & ~3
+
+def dumps_binary(data):
+    # data is from Loop.data
+    out = bytearray()
+    title = data['title'].encode('utf-8')
+    out += HEADER.pack(MAGIC, VERSION, 0, data['length'], len(data['tracks']), len(title))
+    out += title.ljust(padded(len(title)), b'\x00')
+    tracks = []
+    routes = data.get('routes', {})
+    for track, events in data['tracks'].items():
+        name = track.encode('utf-8')
+        port, channel = routes.get(track, (None, 0))
+        if port is None:
+            port, port_size = b'', NO_PORT
+        else:
+            port = port.encode('utf-8')
+            port_size = len(port)
+        out += TRACK_ENTRY.pack(len(name), len(events), port_size, channel)
+        out += name.ljust(padded(len(name)), b'\x00')
+        out += port.ljust(padded(len(port)), b'\x00')
+        steps = sorted(events)
+        tracks.append((array('I', steps), array('h', [events[t] for t in steps])))
+    for steps, notes in tracks:
+        if sys.byteorder != 'little':
+            steps.byteswap()
+            notes.byteswap()
+        out += steps.tobytes()
+        out += notes.tobytes().ljust(padded(len(notes) * 2), b'\x00')
+    bursts = data.get('bursts', {})
+    for track in data['tracks']:
+        track_bursts = bursts.get(track, {})
+        steps = sorted(track_bursts)
+        settings = array('f', [value for t in steps for value in track_bursts[t]])
+        steps = array('I', steps)
+        if sys.byteorder != 'little':
+            steps.byteswap()
+            settings.byteswap()
+        out += struct.pack('<I', len(steps)) + steps.tobytes() + settings.tobytes()
+    gates = data.get('gates', {})
+    note_gates = data.get('note_gates', {})
+    for track in data['tracks']:
+        track_gates = note_gates.get(track, {})
+        steps = sorted(track_gates)
+        values = array('f', [track_gates[t] for t in steps])
+        steps = array('I', steps)
+        if sys.byteorder != 'little':
+            steps.byteswap()
+            values.byteswap()
+        out += struct.pack('<fI', gates.get(track, DEFAULT_GATE), len(steps)) + steps.tobytes() + values.tobytes()
+    return bytes(out)
+
+class BinaryProject:
+    # a memory mapped .bhmb file. steps(track) and notes(track) are views straight onto the file,
+    # so they have to be let go of before close()
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access = mmap.ACCESS_READ)
+        self.view = memoryview(self.map)
+        magic, version, flags, self.length, track_count, title_size = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a biohammer binary project")
+        if version > VERSION:
+            self.close()
+            raise ValueError(f"{path} is version {version}, only up to {VERSION} is supported")
+        offset = HEADER.size
+        self.title = bytes(self.view[offset:offset + title_size]).decode('utf-8')
+        offset += padded(title_size)
+        entries = []
+        self.routes = {} # {track: (port, channel)}
+        for i in range(track_count):
+            if version == 1:
+                name_size, count = TRACK_ENTRY_V1.unpack_from(self.map, offset)
+                port_size, channel = NO_PORT, 0
+                offset += TRACK_ENTRY_V1.size
+            else:
+                name_size, count, port_size, channel = TRACK_ENTRY.unpack_from(self.map, offset)
+                offset += TRACK_ENTRY.size
+            name = bytes(self.view[offset:offset + name_size]).decode('utf-8')
+            offset += padded(name_size)
+            if port_size == NO_PORT:
+                port = None
+            else:
+                port = bytes(self.view[offset:offset + port_size]).decode('utf-8')
+                offset += padded(port_size)
+            entries.append((name, count))
+            self.routes[name] = (port, channel)
+        self.tracks = {} # {track: (offset of its steps, event count)}
+        for name, count in entries:
+            self.tracks[name] = (offset, count)
+            offset += (count * 4) + padded(count * 2)
+        self.bursts = {} # {track: {t: burst}}, copied out of the file since there are never many
+        if version >= 3:
+            for name, count in entries:
+                (burst_count,) = struct.unpack_from('<I', self.map, offset)
+                offset += 4
+                steps = self.array_at(offset, burst_count, 'I')
+                offset += burst_count * 4
+                settings = self.array_at(offset, burst_count * 5, 'f')
+                offset += burst_count * 20
+                self.bursts[name] = {}
+                for i, t in enumerate(steps):
+                    hits, curve, start, end, probability = settings[i * 5:(i + 1) * 5]
+                    # rounded since they went through 32 bit floats
+                    self.bursts[name][t] = (int(hits), round(curve, 6), int(start), int(end), round(probability, 6))
+                if sys.byteorder == 'little':
+                    steps.release()
+                    settings.release()
+        self.gates = {} # {track: gate}
+        self.note_gates = {} # {track: {t: gate}}
+        if version >= 4:
+            for name, count in entries:
+                gate, gate_count = struct.unpack_from('<fI', self.map, offset)
+                offset += 8
+                steps = self.array_at(offset, gate_count, 'I')
+                offset += gate_count * 4
+                values = self.array_at(offset, gate_count, 'f')
+                offset += gate_count * 4
+                self.gates[name] = round(gate, 6)
+                self.note_gates[name] = {t: round(value, 6) for t, value in zip(steps, values)}
+                if sys.byteorder == 'little':
+                    steps.release()
+                    values.release()
+    def steps(self, track):
+        offset, count = self.tracks[track]
+        return self.array_at(offset, count, 'I')
+    def notes(self, track):
+        offset, count = self.tracks[track]
+        return self.array_at(offset + (count * 4), count, 'h')
+    def array_at(self, offset, count, typecode):
+        size = array(typecode).itemsize
+        data = self.view[offset:offset + (count * size)]
+        if sys.byteorder == 'little':
+            return data.cast(typecode)
+        copy = array(typecode, data.tobytes()) # can't use the file's bytes directly on a big endian machine
+        copy.byteswap()
+        return copy
+    def to_loop(self):
+        # the loop's compiled rows are filled straight from the file's arrays. only the sparse events it keeps for
+        # editing are copied out
+        columns = {track: (self.steps(track), self.notes(track)) for track in self.tracks}
+        events = {track: dict(zip(steps, notes)) for track, (steps, notes) in columns.items()}
+        try:
+            return Loop.from_events(self.length, events, title = self.title, routes = self.routes, bursts = self.bursts,
+                                    gates = self.gates, note_gates = self.note_gates, columns = columns)
+        finally:
+            # released even if the file turns out to be bad, so it can still be closed
+            if sys.byteorder == 'little':
+                for steps, notes in columns.values():
+                    steps.release()
+                    notes.release()
+    def close(self):
+        self.view.release()
+        self.map.close()
+        self.file.close()
+    def __enter__(self):
+        return self
+    def __exit__(self, *exc):
+        self.close()
+
+def is_binary(path):
+    with open(path, 'rb') as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+def load(path):
+    # works out the format from the file itself rather than its name
+    if is_binary(path):
+        with BinaryProject(path) as project:
+            return project.to_loop()
+    with open(path, 'r') as file:
+        return Loop.from_data(json.loads(file.read()))
+
+def dumps(data, path):
+    # binary if the file name ends in .bhmb, json otherwise
+    if path.endswith('.bhmb'):
+        return dumps_binary(data)
+    return json.dumps(data).encode('utf-8')
+
+def write_atomic(path, content):
+    # write to a temporary file and rename it over the real one, so a crash part way through never leaves half a file
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as file:
+        file.write(content)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, path)
+
+def save(loop, path):
+    write_atomic(path, dumps(loop.data(), path))
@@ -0,0 +1,120 @@
+import asyncio
+import json
+from threading import Event
+import projectfile
+from arrangement import Arrangement, load
+from daemon import Daemon
+from engine import Engine
+from loop import Loop
+from output import Output, NullPort
+
+def loops():
+    return [Loop.from_events(4, {'a': {0: 60, 2: 62}}, title = 'first'),
+            Loop.from_events(3, {'a': {1: 64}}, title = 'second'),
+            Loop.from_events(1, {'a': {0: 36}}, title = 'third')]
+
+def test_streaming_a_long_arrangement():
+    song = Arrangement()
+    for i in range(300):
+        song.add(loops()[i % 3], repeats = 1 + (i % 2), transpose = i % 5, muted = i % 7 == 0)
+    # what it should play, worked out the slow way
+    expected = []
+    beat = 0
+    for pattern in song.patterns:
+        for step in range(pattern.length()):
+            if not pattern.muted:
+                expected += [(beat, message[1] + pattern.transpose) for port, message in pattern.loop.messages_at_time(step)]
+            beat += 1
+    assert beat == song.length()
+
+    engine = Engine()
+    engine.start()
+    ons = []
+    queued = []
+    done = Event()
+    def send(messages, deadline):
+        queued.append(engine.pending())
+        for port, message in messages:
+            if message[0] == 0x90:
+                ons.append((round(engine.beat_at(deadline), 6), message[1]))
+        if len(ons) == len(expected):
+            done.set()
+    try:
+        engine.restart(60000) # a thousand beats a second
+        engine.play(song.stream(), send, lookahead = 0.02)
+        assert done.wait(10)
+    finally:
+        engine.stop()
+    assert ons == expected
+    # only what's in the lookahead is ever queued, however long the song
+    assert max(queued) < 100
+
+def test_pattern_at():
+    first, second, third = loops()
+    song = Arrangement()
+    song.add(first, repeats = 2)
+    song.add(second)
+    assert song.pattern_at(0) == (song.patterns[0], 0)
+    assert song.pattern_at(7) == (song.patterns[0], 7)
+    assert song.pattern_at(8) == (song.patterns[1], 0)
+    assert song.pattern_at(11) is None
+
+def test_song_files(tmp_path):
+    first, second, third = loops()
+    projectfile.save(first, str(tmp_path / 'first.bhmr'))
+    (tmp_path / 'loops').mkdir()
+    projectfile.save(second, str(tmp_path / 'loops' / 'second.bhmb'))
+    song_path = tmp_path / 'song.bhms'
+    song_path.write_text(json.dumps({'title': 'song', 'patterns': [{'loop': 'first.bhmr', 'repeats': 2},
+                                                                  {'loop': 'loops/second.bhmb', 'transpose': -12, 'muted': True},
+                                                                  {'loop': 'first.bhmr'}]}))
+    song = load(str(song_path))
+    assert song.title == 'song'
+    assert [(p.loop.title, p.repeats, p.transpose, p.muted) for p in song.patterns] == [('first', 2, 0, False), ('second', 1, -12, True), ('first', 1, 0, False)]
+    assert song.patterns[0].loop is song.patterns[2].loop
+
+def test_daemon_plays_songs(tmp_path):
+    projectfile.save(loops()[0], str(tmp_path / 'first.bhmr'))
+    projectfile.save(loops()[1], str(tmp_path / 'second.bhmr'))
+    song_path = tmp_path / 'song.bhms'
+    song_path.write_text(json.dumps({'title': 'song', 'patterns': [{'loop': 'first.bhmr'}, {'loop': 'second.bhmr', 'repeats': 2}]}))
+    daemon = Daemon(str(tmp_path / 'socket'), output = Output(make_port = NullPort), bpm = 600)
+    async def run():
+        assert await daemon.command(f'load {song_path}') == {'ok': 'song'}
+        assert await daemon.command('play') == {'ok': True}
+        await asyncio.sleep(0.55) # into the second pattern
+        status = (await daemon.command('status'))['ok']
+        assert (status['loop'], status['length'], status['pattern']) == ('song', 10, 1)
+        await asyncio.sleep(0.6) # and back round to the start
+        status = (await daemon.command('status'))['ok']
+        assert status['pattern'] == 0 and status['beat'] > 10
+    try:
+        asyncio.run(run())
+    finally:
+        daemon.engine.stop()
+        daemon.output.stop()
+
+def test_daemon_routes_tracks(tmp_path):
+    projectfile.save(loops()[0], str(tmp_path / 'first.bhmr'))
+    song_path = tmp_path / 'song.bhms'
+    song_path.write_text(json.dumps({'title': 'song', 'patterns': [{'loop': 'first.bhmr'}, {'loop': 'first.bhmr', 'transpose': 12}]}))
+    daemon = Daemon(str(tmp_path / 'socket'), output = Output(make_port = NullPort))
+    async def run():
+        assert 'error' in await daemon.command('route a synth 1')
+        assert await daemon.command(f'load {tmp_path / "first.bhmr"}') == {'ok': 'first'}
+        assert await daemon.command('route a my synth 3') == {'ok': True}
+        assert daemon.loop.routes['a'] == ('my synth', 3)
+        assert daemon.loop.messages_at_time(2) == (('my synth', (0x93, 62, 127)),)
+        assert await daemon.command('route a default 0') == {'ok': True}
+        assert daemon.loop.routes['a'] == (None, 0)
+        for bad in ('route b synth 1', 'route a synth 16', 'route a synth x', 'route a 1'):
+            assert 'error' in await daemon.command(bad)
+        assert daemon.loop.routes['a'] == (None, 0)
+        assert await daemon.command(f'load {song_path}') == {'ok': 'song'}
+        assert await daemon.command('route a synth 9') == {'ok': True}
+        assert [pattern.loop.routes['a'] for pattern in daemon.loop.patterns] == [('synth', 9), ('synth', 9)]
+    try:
+        asyncio.run(run())
+    finally:
+        daemon.engine.stop()
+        daemon.output.stop()
@@ -0,0 +1,96 @@
+import os
+from autosave import BackgroundWriter, Journal, recover
+from loop import Loop
+import projectfile
+
+def edited_loop():
+    loop = Loop(8, ['a', 'b'])
+    loop.write('a', 0, 60)
+    loop.write('b', 3, 64)
+    return loop
+
+def test_recover_replays_every_edit(tmp_path):
+    journal = Journal(str(tmp_path / 'journal'))
+    loop = edited_loop()
+    journal.start(loop)
+    loop.write('a', 2, 62)
+    loop.write('a', 0, None)
+    loop.set_route('b', 'synth', 5)
+    loop.set_burst('a', 2, (4, 0.5, 127, 40, 1.0))
+    loop.set_track_gate('b', 0.5)
+    loop.set_gate('b', 3, 0.25)
+    loop.set_length(16)
+    loop.write('b', 12, 70)
+    loop.add_track('a') # ends up as 'a+'
+    loop.write('a+', 5, 48)
+    journal.flush()
+    assert recover(journal.path).data() == loop.data()
+
+def test_recover_after_deleting_the_last_track(tmp_path):
+    # deleting the last track adds a new one, which is recorded after the delete. replaying the delete adds it
+    # again, so the recorded add mustn't add a second one, but a later add of a track of the same name still should
+    journal = Journal(str(tmp_path / 'journal'))
+    loop = edited_loop()
+    journal.start(loop)
+    loop.delete_track('a')
+    loop.delete_track('b')
+    assert list(loop.events) == ['new track']
+    loop.add_track('new track')
+    loop.write('new track+', 1, 50)
+    journal.flush()
+    recovered = recover(journal.path)
+    assert list(recovered.events) == ['new track', 'new track+']
+    assert recovered.data() == loop.data()
+
+def test_recover_stops_at_a_half_written_line(tmp_path):
+    journal = Journal(str(tmp_path / 'journal'))
+    loop = edited_loop()
+    journal.start(loop)
+    loop.write('a', 1, 61)
+    journal.flush()
+    expected = loop.data()
+    with open(journal.path, 'a') as file:
+        file.write('["write", "a", 2')
+    assert recover(journal.path).data() == expected
+    assert recover(str(tmp_path / 'missing')) is None
+
+def test_starting_again_truncates_and_discard_removes(tmp_path):
+    journal = Journal(str(tmp_path / 'journal'))
+    loop = edited_loop()
+    journal.start(loop)
+    loop.write('a', 1, 61)
+    journal.flush()
+    journal.start(loop) # after a save
+    journal.flush()
+    with open(journal.path) as file:
+        assert len(file.readlines()) == 1
+    journal.discard()
+    assert not os.path.exists(journal.path)
+    loop.write('a', 2, 62) # no longer recorded
+    assert journal.pending == []
+
+def test_background_writer_saves_atomically(tmp_path):
+    journal = Journal(str(tmp_path / 'journal'))
+    writer = BackgroundWriter(journal, flush_interval = 0.01)
+    path = str(tmp_path / 'loop.bhmr')
+    loop = edited_loop()
+    journal.start(loop)
+    try:
+        writer.save(loop, path)
+        revision = loop.revision
+        loop.write('a', 1, 61) # after the save was queued, so not in it
+        writer.wait()
+        assert writer.saved_revision == revision
+        saved = projectfile.load(path)
+        assert saved.events == {'a': {0: 60}, 'b': {3: 64}}
+        assert not os.path.exists(path + '.tmp')
+        # a save that can't be written leaves the last good file as it was
+        os.mkdir(path + '.tmp')
+        writer.save(loop, path)
+        writer.wait()
+        assert writer.saved_revision == revision
+        assert projectfile.load(path).events == saved.events
+    finally:
+        writer.stop()
+    # stopping flushes the journal
+    assert recover(journal.path).data() == loop.data()
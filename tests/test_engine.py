@@ -0,0 +1,149 @@
+import statistics
+import time
+from threading import Event
+from engine import Engine
+
+class Recorder:
+    # a send for Engine.play that records (messages, when they were due, when they were sent)
+    def __init__(self, clock = time.perf_counter):
+        self.clock = clock
+        self.sent = []
+        self.done = Event()
+        self.expected = None
+    def send(self, messages, deadline):
+        self.sent.append((messages, deadline, self.clock()))
+        if self.expected is not None and len(self.sent) >= self.expected:
+            self.done.set()
+
+def steps(count):
+    # a source for Engine.play with one message per beat, the beat as its note
+    for beat in range(count):
+        yield beat, ((None, (0x90, beat, 127)),), (), ()
+
+def test_no_drift_over_a_long_run():
+    engine = Engine()
+    engine.start()
+    recorder = Recorder()
+    recorder.expected = 400
+    try:
+        engine.restart(6000) # 100 beats a second, so 4 seconds
+        start = engine.time_at(0)
+        wall_start = time.time() - (engine.now() - start)
+        engine.play(steps(400), recorder.send, lookahead = 0.2)
+        assert recorder.done.wait(10)
+    finally:
+        engine.stop()
+    assert [messages[0][1][1] for messages, due, sent in recorder.sent] == list(range(400))
+    # deadlines come from the tempo map, not from adding up intervals, so the last is exactly where it should be
+    for beat, (messages, due, sent) in enumerate(recorder.sent):
+        assert abs(due - (start + (beat * 0.01))) < 1e-9
+    lateness = [sent - due for messages, due, sent in recorder.sent]
+    assert min(lateness) >= 0
+    assert statistics.median(lateness) < 0.005
+    # being late doesn't build up over the run
+    assert abs(statistics.median(lateness[-100:]) - statistics.median(lateness[:100])) < 0.005
+    # and the engine's clock keeps with the wall clock
+    wall_end = time.time()
+    assert abs((wall_end - wall_start) - (engine.now() - start)) < 0.01
+
+def test_schedule_order_and_lateness():
+    engine = Engine()
+    engine.start()
+    fired = []
+    done = Event()
+    def callback(i):
+        fired.append((i, engine.deadline, engine.now()))
+        if len(fired) == 50:
+            done.set()
+    try:
+        now = engine.now()
+        # scheduled out of order, fired in order of deadline
+        for i in reversed(range(50)):
+            engine.schedule(now + 0.05 + (i * 0.005), callback, i)
+        assert done.wait(5)
+    finally:
+        engine.stop()
+    assert [i for i, due, t in fired] == list(range(50))
+    # never early. how late depends on what else the machine is doing, so it's the typical lateness that's checked
+    lateness = sorted(t - due for i, due, t in fired)
+    assert lateness[0] >= 0
+    assert lateness[len(lateness) // 2] < 0.005
+
+def test_idles_without_using_cpu():
+    engine = Engine()
+    engine.start()
+    try:
+        engine.schedule(engine.now() + 60, print, 'never')
+        time.sleep(1) # for start()'s preloading of numpy to finish
+        cpu = time.process_time()
+        time.sleep(1)
+        assert time.process_time() - cpu < 0.05
+    finally:
+        engine.stop()
+
+def test_start_and_stop():
+    engine = Engine()
+    fired = Event()
+    engine.schedule(engine.now(), fired.set) # queued before starting, fires once started
+    engine.start()
+    thread = engine.thread
+    engine.start() # starting again does nothing
+    assert engine.thread is thread
+    assert fired.wait(1)
+    engine.stop()
+    assert engine.thread is None and not thread.is_alive()
+    engine.stop() # so does stopping again
+    # and it can be started again after stopping
+    fired.clear()
+    engine.schedule(engine.now(), fired.set)
+    engine.start()
+    try:
+        assert fired.wait(1)
+    finally:
+        engine.stop()
+
+def test_flush_drops_everything_queued():
+    engine = Engine()
+    engine.start()
+    recorder = Recorder()
+    fired = []
+    released = []
+    try:
+        engine.restart(60)
+        engine.play(steps(1000), recorder.send, lookahead = 5, release = lambda: released.append(engine.now()))
+        engine.schedule(engine.now() + 0.2, fired.append, 'late')
+        time.sleep(0.05)
+        assert engine.pending() > 0
+        engine.flush()
+        assert engine.pending() == 0
+        assert len(released) == 1 # what was sounding won't get its note offs now
+        time.sleep(0.3)
+    finally:
+        engine.stop()
+    assert fired == []
+    # only the first beat was due before the flush, and nothing more is pulled from the source after it
+    assert [messages[0][1][1] for messages, due, sent in recorder.sent] == [0]
+    assert engine.source is None
+
+def test_syncing_every_beat_keeps_the_tempo_map_short():
+    engine = Engine()
+    engine.restart(120, start_time = 0)
+    for beat in range(1, 2000):
+        engine.sync(beat, beat * 0.5, 120)
+        assert len(engine.tempo.segments) <= 2
+    for bpm in range(100, 200):
+        engine.set_tempo(bpm)
+        assert len(engine.tempo.segments) <= 2
+
+def test_forgetting_keeps_what_is_queued():
+    clock = lambda: 10.0 # beat 20 at 120 bpm
+    engine = Engine(clock = clock)
+    engine.restart(120, start_time = 0)
+    for beat in range(1, 15):
+        engine.tempo.set_tempo(120, beat) # segments from before now, as if they'd been left from earlier changes
+    engine.schedule_beat(18, print, 'queued before now') # late, but still queued
+    engine.schedule_beat(30, print, 'queued after now')
+    engine.set_tempo(60, 25)
+    assert engine.tempo.beats[0] <= 18
+    assert engine.time_at(18) == 9.0
+    assert engine.time_at(30) == 12.5 + 5
@@ -0,0 +1,110 @@
+import queue
+import time
+from multiprocessing import shared_memory
+from threading import Thread
+import pytest
+from engineprocess import EngineProcess, Child
+from loop import Loop
+from output import NullPort
+
+def in_process():
+    # an EngineProcess with its Child in this process, and the commands between them handed over by deliver() rather
+    # than by a queue between processes, so what the child does with each one can be looked at
+    process = EngineProcess(make_port = NullPort)
+    process.commands = queue.Queue()
+    child = Child(process.commands, NullPort, process.timing_memory.name, process.timing.size)
+    return process, child
+
+def deliver(child):
+    # what Child.run does with the commands that have been sent
+    while not child.commands_queue.empty():
+        command = child.commands_queue.get()
+        child.commands[command[0]](*command[1:])
+
+def stop(process, child):
+    # the child runs until it gets the stop command, as it does in its own process
+    process.process = Thread(target = child.run)
+    process.process.start()
+    process.stop()
+
+def compiled(loop):
+    return ({track: list(row) for track, row in loop.steps.items()}, loop.step_notes, loop.step_messages,
+            loop.step_bursts, loop.step_releases)
+
+def test_edits_are_compiled_in_the_child():
+    process, child = in_process()
+    try:
+        loop = Loop(8, ['a', 'b'])
+        loop.write('a', 0, 60)
+        process.restart(120)
+        process.play_loop(loop)
+        deliver(child)
+        assert compiled(child.loop) == compiled(loop)
+        shared = child.steps[0].name
+        loop.write('b', 3, 62)
+        loop.write('a', 5, 64)
+        loop.set_burst('a', 5, (3, 1.0, 127, 40, 1.0))
+        loop.set_gate('b', 3, 0.5)
+        loop.set_track_gate('a', 0.25)
+        loop.set_route('b', 'synth', 4)
+        loop.write('a', 0, None)
+        # clearing a note clears its burst and gate in the child too
+        loop.write('a', 5, None)
+        loop.write('a', 5, 65)
+        assert [command[0] for command in list(process.commands.queue)] == ['write', 'write', 'set_burst', 'set_gate', 'set_track_gate',
+                                                                            'set_route', 'write', 'write', 'write']
+        deliver(child)
+        assert compiled(child.loop) == compiled(loop)
+        assert child.loop.bursts == loop.bursts and child.loop.note_gates == loop.note_gates
+        # all through the same shared rows
+        assert child.steps[0].name == shared
+    finally:
+        stop(process, child)
+
+@pytest.mark.parametrize('change', ['add_track', 'delete_track', 'set_length'])
+def test_changes_of_shape_share_the_loop_again(change):
+    process, child = in_process()
+    try:
+        loop = Loop(8, ['a', 'b'])
+        loop.write('a', 0, 60)
+        loop.write('b', 6, 62)
+        process.play_loop(loop)
+        deliver(child)
+        old = child.steps[0].name
+        if change == 'add_track':
+            loop.add_track('c')
+            loop.write('c', 2, 70)
+        elif change == 'delete_track':
+            loop.delete_track('a')
+        else:
+            loop.set_length(4)
+        deliver(child)
+        assert child.steps[0].name != old
+        assert compiled(child.loop) == compiled(loop)
+        # the child let go of the old block and it's gone
+        with pytest.raises(FileNotFoundError):
+            shared_memory.SharedMemory(old)
+        # and edits go to the new one
+        loop.write('b', 1, 50)
+        deliver(child)
+        assert compiled(child.loop) == compiled(loop)
+    finally:
+        stop(process, child)
+
+def test_plays_in_a_child_process():
+    process = EngineProcess(make_port = NullPort)
+    process.start()
+    try:
+        loop = Loop(4, ['a'])
+        for t in range(4):
+            loop.write('a', t, 60)
+        process.set_default('null')
+        process.restart(6000)
+        process.play_loop(loop)
+        deadline = time.perf_counter() + 20 # starting the child takes a while on a slow machine
+        while process.timing.counter[0] == 0 and time.perf_counter() < deadline:
+            time.sleep(0.05)
+    finally:
+        process.stop()
+    # what the child sent is recorded in the timing log shared with it, and kept after it's stopped
+    assert process.timing.counter[0] > 0
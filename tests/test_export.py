@@ -0,0 +1,64 @@
+import struct
+from loop import Loop
+from midiconstants import NOTE_ON, NOTE_OFF
+from export import render_loop, TICKS_PER_BEAT
+
+def read_smf(data):
+    # (ticks per beat, [(absolute tick, event bytes)]) from a type 0 file as render_loop writes it, with the end of
+    # track meta event included
+    assert data[:4] == b'MThd'
+    size, file_type, track_count, ticks_per_beat = struct.unpack('>IHHH', data[4:14])
+    assert (size, file_type, track_count) == (6, 0, 1)
+    assert data[14:18] == b'MTrk'
+    (track_size,) = struct.unpack('>I', data[18:22])
+    track = data[22:22 + track_size]
+    assert len(track) == track_size
+    events = []
+    tick = 0
+    i = 0
+    while i < len(track):
+        delta = 0
+        while True:
+            byte = track[i]
+            i += 1
+            delta = (delta << 7) | (byte & 0x7F)
+            if byte < 0x80:
+                break
+        tick += delta
+        if track[i] == 0xFF:
+            length = track[i + 2] # all the meta events written are short
+            event = track[i:i + 3 + length]
+        else:
+            event = track[i:i + 3]
+        i += len(event)
+        events.append((tick, bytes(event)))
+    return ticks_per_beat, events
+
+def notes(events):
+    return [(tick, event[0] & 0xF0, event[1]) for tick, event in events if event[0] & 0xF0 in (NOTE_ON, NOTE_OFF)]
+
+def test_loop_not_starting_on_step_0():
+    loop = Loop.from_events(4, {'a': {1: 60, 3: 62}})
+    ticks_per_beat, events = read_smf(render_loop(loop, bpm = 120, repeats = 2))
+    assert ticks_per_beat == TICKS_PER_BEAT
+    step = TICKS_PER_BEAT
+    assert notes(events) == [(1 * step, NOTE_ON, 60), (2 * step, NOTE_OFF, 60), (3 * step, NOTE_ON, 62), (4 * step, NOTE_OFF, 62),
+                             (5 * step, NOTE_ON, 60), (6 * step, NOTE_OFF, 60), (7 * step, NOTE_ON, 62), (8 * step, NOTE_OFF, 62)]
+    assert events[-1] == (8 * step, b'\xff\x2f\x00')
+
+def test_gates_and_repeats():
+    loop = Loop.from_events(2, {'a': {0: 60}, 'b': {1: 64}}, gates = {'a': 0.5}, note_gates = {'b': {1: 0.25}})
+    ticks_per_beat, events = read_smf(render_loop(loop, repeats = 3))
+    step = TICKS_PER_BEAT
+    expected = []
+    for i in range(3):
+        start = i * 2 * step
+        expected += [(start, NOTE_ON, 60), (start + (step // 2), NOTE_OFF, 60),
+                     (start + step, NOTE_ON, 64), (start + step + (step // 4), NOTE_OFF, 64)]
+    assert notes(events) == expected
+    assert events[-1] == (6 * step, b'\xff\x2f\x00')
+
+def test_empty_loop():
+    ticks_per_beat, events = read_smf(render_loop(Loop(4, ['a']), repeats = 2))
+    assert notes(events) == []
+    assert events[-1] == (8 * TICKS_PER_BEAT, b'\xff\x2f\x00')
@@ -0,0 +1,14 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def imports_without_rtmidi(*modules):
+    # imports modules in a fresh interpreter where importing rtmidi fails, as it does without libasound
+    code = 'import sys; sys.modules["rtmidi"] = None; sys.modules["rtmidi.midiconstants"] = None; ' + '; '.join(f'import {module}' for module in modules)
+    return subprocess.run([sys.executable, '-c', code], cwd = ROOT, capture_output = True, text = True)
+
+def test_display_free_modules_dont_need_rtmidi():
+    result = imports_without_rtmidi('loop', 'burst', 'engine', 'output', 'timing', 'projectfile', 'autosave', 'engineprocess', 'benchmark', 'export', 'midiclock', 'daemon')
+    assert result.returncode == 0, result.stderr
@@ -0,0 +1,58 @@
+import pytest
+from loop import Loop, EMPTY
+import projectfile
+from midiconstants import NOTE_ON
+
+def test_write_compiles_and_notifies():
+    loop = Loop(4, ['a'])
+    edits = []
+    loop.listeners.append(lambda *edit: edits.append(edit))
+    loop.write('a', 1, 60)
+    assert loop.steps['a'][1] == 60
+    assert loop.messages_at_time(1) == ((None, (NOTE_ON, 60, 127)),)
+    assert edits == [('write', 'a', 1, 60)]
+    loop.write('a', 1, None)
+    assert loop.steps['a'][1] == EMPTY
+    assert loop.messages_at_time(1) == ()
+
+@pytest.mark.parametrize('note', [-1, 128, 40000])
+def test_write_rejects_notes_out_of_midi_range(note):
+    loop = Loop(4, ['a'])
+    loop.write('a', 1, 60)
+    edits = []
+    loop.listeners.append(lambda *edit: edits.append(edit))
+    revision = loop.revision
+    with pytest.raises(ValueError):
+        loop.write('a', 1, note)
+    # the loop is left as it was, and nobody hears about it
+    assert loop.events['a'] == {1: 60}
+    assert loop.steps['a'][1] == 60
+    assert loop.messages_at_time(1) == ((None, (NOTE_ON, 60, 127)),)
+    assert loop.revision == revision
+    assert edits == []
+
+def test_incremental_updates_match_a_full_compile():
+    loop = Loop(4, ['a', 'b'])
+    loop.write('a', 0, 60)
+    loop.write('b', 0, 62)
+    loop.write('b', 6, 64) # past the end, kept for when it grows
+    loop.set_route('b', 'synth', 3)
+    loop.set_length(8)
+    loop.delete_track('a')
+    compiled = Loop.from_data(loop.data())
+    assert [loop.messages_at_time(t) for t in range(8)] == [compiled.messages_at_time(t) for t in range(8)]
+    assert [loop.releases_at_time(t) for t in range(8)] == [compiled.releases_at_time(t) for t in range(8)]
+    assert loop.steps == compiled.steps
+
+@pytest.mark.parametrize('note', [-1, 128, 200, 40000])
+def test_loading_rejects_notes_out_of_midi_range(note, tmp_path):
+    data = Loop.from_events(4, {'a': {0: 60, 2: 62}}).data()
+    data['tracks']['a'][2] = note
+    with pytest.raises(ValueError, match = 'not a midi note'):
+        Loop.from_data(data)
+    # the binary format goes through from_events too
+    if -32768 <= note < 32768:
+        path = str(tmp_path / 'loop.bhmb')
+        projectfile.write_atomic(path, projectfile.dumps_binary(data))
+        with pytest.raises(ValueError, match = 'not a midi note'):
+            projectfile.load(path)
@@ -0,0 +1,130 @@
+import heapq
+import random
+from threading import Event
+from engine import Engine
+from output import Output, Loopback
+from midiclock import ClockOut, ClockIn, PPQN, GAP
+from midiconstants import TIMING_CLOCK, SONG_START, SONG_CONTINUE, SONG_STOP, SONG_POSITION_POINTER
+
+class FakeClock:
+    # an engine clock that only moves when it's told to
+    def __init__(self, t = 0.0):
+        self.t = t
+    def __call__(self):
+        return self.t
+
+def run_until(engine, clock, t):
+    # do what the engine's thread would, without the thread: fire everything due by t in order, with the clock at
+    # each event's deadline
+    while engine.queue and engine.queue[0][0] <= t:
+        engine.deadline, _, _, callback, args = heapq.heappop(engine.queue)
+        clock.t = engine.deadline
+        callback(*args)
+    clock.t = t
+
+def test_clock_out_sends_pulses_on_the_beat():
+    clock = FakeClock()
+    engine = Engine(clock = clock)
+    sent = []
+    def send(messages, deadline = None):
+        sent.append((messages[0][1], deadline))
+    clock_out = ClockOut(engine, send)
+    engine.restart(600, start_time = 1.0) # a beat every 0.1 seconds
+    clock_out.start()
+    run_until(engine, clock, 1.449)
+    clock_out.stop()
+    run_until(engine, clock, 1.6)
+    assert sent[0] == ((SONG_START,), 1.0) and sent[-1] == ((SONG_STOP,), None)
+    pulses = [deadline for message, deadline in sent if message == (TIMING_CLOCK,)]
+    assert len(pulses) == (4 * PPQN) + 12 # up to 1.449, and nothing after stopping
+    for n, deadline in enumerate(pulses):
+        assert abs(deadline - (1.0 + (n * 0.1 / PPQN))) < 1e-9
+
+def test_clock_out_follows_tempo_changes():
+    clock = FakeClock()
+    engine = Engine(clock = clock)
+    sent = []
+    clock_out = ClockOut(engine, lambda messages, deadline = None: sent.append(deadline))
+    engine.restart(600, start_time = 0)
+    clock_out.start()
+    run_until(engine, clock, 0.19) # nearly two beats in
+    engine.set_tempo(300, 2)
+    run_until(engine, clock, 0.61) # and just over two more at half the speed
+    pulses = sent[1:]
+    assert len(pulses) == (4 * PPQN) + 2
+    for n, deadline in enumerate(pulses[2 * PPQN:]):
+        assert abs(deadline - (0.2 + (n * 0.2 / PPQN))) < 1e-9
+
+def clock_in(**callbacks):
+    clock = FakeClock()
+    engine = Engine(clock = clock)
+    return clock, engine, ClockIn(engine, 'loopback', make_port = Loopback().make_in, **callbacks)
+
+def jittered(bpm, start, count, jitter = 0.001, seed = 1):
+    # pulse times for count pulses at bpm from start, each up to jitter seconds early or late
+    rng = random.Random(seed)
+    return [start + (n * 60 / (bpm * PPQN)) + rng.uniform(-jitter, jitter) for n in range(count)]
+
+def test_clock_in_follows_a_jittery_clock():
+    started = []
+    stopped = []
+    def on_start(t):
+        started.append(t)
+        engine.restart(120, start_time = t)
+    clock, engine, follower = clock_in(on_start = on_start, on_stop = lambda: stopped.append(True))
+    times = jittered(133, 5.0, 8 * PPQN)
+    follower.handle((SONG_START,), 4.99)
+    assert started == [] # not until the first pulse
+    for t in times:
+        clock.t = t
+        follower.handle((TIMING_CLOCK,), t)
+    assert started == [times[0]]
+    assert abs(follower.bpm() - 133) < 0.5
+    # in step with where the clock's beats really are to within a millisecond, despite the jitter
+    beat = 8 - (1 / PPQN) # the last pulse
+    assert abs(engine.time_at(beat) - (5.0 + (beat * 60 / 133))) < 0.001
+    assert len(engine.tempo.segments) <= 2
+    follower.handle((SONG_STOP,), times[-1] + 0.01)
+    assert stopped == [True] and not follower.running
+
+def test_clock_in_continues_from_a_song_position():
+    continued = []
+    clock, engine, follower = clock_in(on_continue = lambda beat, t: continued.append((beat, t)))
+    sixteenths = 18 # beat 4.5
+    follower.handle((SONG_POSITION_POINTER, sixteenths & 0x7F, sixteenths >> 7), 1.0)
+    follower.handle((SONG_CONTINUE,), 1.0)
+    follower.handle((TIMING_CLOCK,), 1.01)
+    assert continued == [(4.5, 1.01)]
+
+def test_clock_in_starts_its_estimate_again_after_a_gap():
+    clock, engine, follower = clock_in()
+    for t in jittered(90, 0, 2 * PPQN):
+        follower.handle((TIMING_CLOCK,), t)
+    assert abs(follower.bpm() - 90) < 0.5
+    # the clock stopped without saying so and came back at another tempo
+    later = jittered(150, 2 + GAP, PPQN - 1, seed = 2)
+    for t in later:
+        follower.handle((TIMING_CLOCK,), t)
+    assert follower.bpm() is None # only the pulses since the gap count, and there aren't enough yet
+    follower.handle((TIMING_CLOCK,), later[-1] + (60 / (150 * PPQN)))
+    assert abs(follower.bpm() - 150) < 0.5
+
+def test_clock_in_receives_through_a_loopback():
+    # just that messages get from a port's thread to handle, timing is tested above without threads
+    cable = Loopback()
+    output = Output(make_port = cable.make_out)
+    output.set_default('loopback')
+    engine = Engine()
+    started = Event()
+    stopped = Event()
+    follower = ClockIn(engine, 'loopback', make_port = cable.make_in, on_start = lambda t: started.set(), on_stop = stopped.set)
+    try:
+        output.send(((None, (SONG_START,)),))
+        output.send(((None, (TIMING_CLOCK,)),))
+        assert started.wait(10)
+        output.send(((None, (SONG_STOP,)),))
+        assert stopped.wait(10)
+        assert follower.count == 1
+    finally:
+        follower.close()
+        output.stop()
@@ -0,0 +1,86 @@
+import heapq
+import pytest
+from engine import Engine
+from loop import Loop
+from output import Output, Voices
+from midiconstants import NOTE_ON, NOTE_OFF, CONTROL_CHANGE, ALL_NOTES_OFF
+
+class Recorder:
+    # ports like NullPort, 'one' and 'two', that write down everything sent through them as (port name, message)
+    def __init__(self):
+        self.sent = []
+    def make_port(self):
+        return RecordingPort(self)
+
+class RecordingPort:
+    def __init__(self, recorder):
+        self.recorder = recorder
+        self.name = None
+    def get_ports(self):
+        return ['one', 'two']
+    def open_port(self, port = 0, name = None):
+        self.name = self.get_ports()[port]
+    def close_port(self):
+        pass
+    def send_message(self, message):
+        self.recorder.sent.append((self.name, tuple(message)))
+
+def test_voices():
+    voices = Voices()
+    voices.sent('one', (NOTE_ON, 60, 127))
+    voices.sent('one', (NOTE_ON, 62, 127))
+    voices.sent('one', (NOTE_ON | 1, 60, 127))
+    voices.sent('two', (NOTE_ON, 48, 127))
+    voices.sent('one', (NOTE_OFF, 60, 0))
+    voices.sent('one', (NOTE_ON | 1, 60, 0)) # a note on with velocity 0 is a note off
+    voices.sent('one', (CONTROL_CHANGE, 7, 100)) # anything else is ignored
+    assert voices.release('one') == [('one', (NOTE_OFF, 62, 0)), ('one', (CONTROL_CHANGE, ALL_NOTES_OFF, 0))]
+    assert voices.release('one') == []
+    assert voices.release() == [('two', (NOTE_OFF, 48, 0)), ('two', (CONTROL_CHANGE, ALL_NOTES_OFF, 0))]
+    assert voices.release() == []
+
+def sounding(recorder):
+    # an engine playing a loop through an Output, just past its first step, with the notes from it still sounding.
+    # the engine's thread isn't running, the step is fired by hand
+    output = Output(make_port = recorder.make_port)
+    output.set_default('one')
+    engine = Engine(clock = lambda: 0.1)
+    engine.restart(120, start_time = 0)
+    loop = Loop(4, ['a', 'b'])
+    loop.write('a', 0, 60)
+    loop.write('b', 0, 64)
+    loop.set_route('b', 'two', 3)
+    engine.play(loop.stream(0), output.send, release = output.release)
+    while engine.queue[0][0] <= 0.1:
+        engine.deadline, _, _, callback, args = heapq.heappop(engine.queue)
+        callback(*args)
+    assert engine.releases # the note offs are still to come
+    return engine, output
+
+ONS = [('one', (NOTE_ON, 60, 127)), ('two', (NOTE_ON | 3, 64, 127))]
+RELEASED = [('one', (NOTE_OFF, 60, 0)), ('one', (CONTROL_CHANGE, ALL_NOTES_OFF, 0)),
+            ('two', (NOTE_OFF | 3, 64, 0)), ('two', (CONTROL_CHANGE | 3, ALL_NOTES_OFF, 0))]
+
+@pytest.mark.parametrize('change', ['restart', 'set_tempo'])
+def test_engine_changes_release_what_is_sounding(change):
+    # both drop the note offs that were queued, so the notes have to be silenced some other way
+    recorder = Recorder()
+    engine, output = sounding(recorder)
+    if change == 'restart':
+        engine.restart(120)
+    else:
+        engine.set_tempo(90)
+    output.stop()
+    # and nothing more when the output stops, since they've been released already
+    assert recorder.sent == ONS + RELEASED
+
+def test_changing_the_default_port_releases_it():
+    recorder = Recorder()
+    engine, output = sounding(recorder)
+    output.set_default('two')
+    output.send([(None, (NOTE_ON, 72, 127))]) # now goes to two
+    output.stop()
+    # only what was on the old default port, the rest when the output stops
+    assert recorder.sent == ONS + RELEASED[:2] + [('two', (NOTE_ON, 72, 127)),
+                                                  ('two', (NOTE_OFF | 3, 64, 0)), ('two', (CONTROL_CHANGE | 3, ALL_NOTES_OFF, 0)),
+                                                  ('two', (NOTE_OFF, 72, 0)), ('two', (CONTROL_CHANGE, ALL_NOTES_OFF, 0))]
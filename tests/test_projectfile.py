@@ -0,0 +1,113 @@
+import struct
+import pytest
+from loop import Loop, DEFAULT_GATE
+import projectfile
+from projectfile import HEADER, TRACK_ENTRY, TRACK_ENTRY_V1, NO_PORT, MAGIC, padded
+
+def full_loop():
+    loop = Loop(16, ['kick', 'bass', 'lead'])
+    loop.title = 'títle'
+    for t in range(0, 16, 4):
+        loop.write('kick', t, 36)
+    for t, note in ((1, 40), (5, 43), (9, 45), (14, 47)):
+        loop.write('bass', t, note)
+    loop.write('lead', 3, 72)
+    loop.set_route('bass', 'my synth', 2)
+    loop.set_route('lead', 'sýnth 2', 15)
+    loop.set_burst('kick', 4, (3, 0.5, 127, 60, 0.75))
+    loop.set_burst('lead', 3, (6, 2.0, 100, 20, 1.0))
+    loop.set_track_gate('bass', 0.5)
+    loop.set_gate('bass', 9, 0.25)
+    loop.set_gate('kick', 4, 0.125)
+    return loop
+
+def compiled(loop):
+    return (loop.length, dict(loop.steps), loop.step_notes, loop.step_messages, loop.step_bursts, loop.step_releases)
+
+@pytest.mark.parametrize('extension', ['bhmr', 'bhmb'])
+def test_round_trip(extension, tmp_path):
+    loop = full_loop()
+    path = str(tmp_path / f'loop.{extension}')
+    projectfile.save(loop, path)
+    assert projectfile.is_binary(path) == (extension == 'bhmb')
+    loaded = projectfile.load(path)
+    assert loaded.title == 'títle'
+    assert loaded.data() == loop.data()
+    assert compiled(loaded) == compiled(loop)
+
+@pytest.mark.parametrize('extension', ['bhmr', 'bhmb'])
+def test_round_trip_keeps_events_past_the_end(extension, tmp_path):
+    loop = full_loop()
+    loop.set_length(8)
+    path = str(tmp_path / f'loop.{extension}')
+    projectfile.save(loop, path)
+    loaded = projectfile.load(path)
+    assert loaded.events['bass'][14] == 47
+    assert len(loaded.steps['bass']) == 8
+    assert compiled(loaded) == compiled(loop)
+    loaded.set_length(16)
+    assert loaded.steps['bass'][14] == 47
+
+def old_file(version, length, tracks, title = 'old'):
+    # a binary file as an earlier version wrote it. tracks is [(name, {t: note}, (port, channel), {t: burst})]
+    title = title.encode('utf-8')
+    out = bytearray(HEADER.pack(MAGIC, version, 0, length, len(tracks), len(title)))
+    out += title.ljust(padded(len(title)), b'\x00')
+    for name, events, (port, channel), bursts in tracks:
+        name = name.encode('utf-8')
+        if version == 1:
+            out += TRACK_ENTRY_V1.pack(len(name), len(events))
+            out += name.ljust(padded(len(name)), b'\x00')
+        else:
+            port = b'' if port is None else port.encode('utf-8')
+            out += TRACK_ENTRY.pack(len(name), len(events), NO_PORT if port == b'' else len(port), channel)
+            out += name.ljust(padded(len(name)), b'\x00') + port.ljust(padded(len(port)), b'\x00')
+    for name, events, route, bursts in tracks:
+        steps = sorted(events)
+        out += struct.pack(f'<{len(steps)}I', *steps)
+        out += struct.pack(f'<{len(steps)}h', *[events[t] for t in steps]).ljust(padded(len(steps) * 2), b'\x00')
+    if version >= 3:
+        for name, events, route, bursts in tracks:
+            steps = sorted(bursts)
+            out += struct.pack(f'<I{len(steps)}I', len(steps), *steps)
+            out += struct.pack(f'<{len(steps) * 5}f', *[value for t in steps for value in bursts[t]])
+    return bytes(out)
+
+TRACKS = [('kick', {0: 36, 2: 36}, ('drums', 9), {2: (4, 0.5, 127, 64, 1.0)}),
+          ('bass', {1: 40, 3: 43}, (None, 1), {})]
+
+@pytest.mark.parametrize('version', [1, 2, 3])
+def test_loading_older_versions(version, tmp_path):
+    path = str(tmp_path / 'old.bhmb')
+    projectfile.write_atomic(path, old_file(version, 4, TRACKS))
+    loop = projectfile.load(path)
+    assert loop.title == 'old'
+    assert loop.events == {'kick': {0: 36, 2: 36}, 'bass': {1: 40, 3: 43}}
+    assert loop.routes == ({'kick': (None, 0), 'bass': (None, 0)} if version == 1 else {'kick': ('drums', 9), 'bass': (None, 1)})
+    assert loop.bursts == ({'kick': {2: (4, 0.5, 127, 64, 1.0)}, 'bass': {}} if version >= 3 else {'kick': {}, 'bass': {}})
+    # gates came in with version 4
+    assert loop.gates == {'kick': DEFAULT_GATE, 'bass': DEFAULT_GATE}
+    assert loop.note_gates == {'kick': {}, 'bass': {}}
+    assert compiled(loop) == compiled(Loop.from_data(loop.data()))
+
+def test_loading_rejects_other_files(tmp_path):
+    path = str(tmp_path / 'loop.bhmb')
+    projectfile.write_atomic(path, old_file(projectfile.VERSION + 1, 4, TRACKS))
+    with pytest.raises(ValueError):
+        projectfile.load(path)
+    projectfile.write_atomic(path, b'BHMX' + old_file(2, 4, TRACKS)[4:])
+    with pytest.raises(ValueError):
+        projectfile.BinaryProject(path)
+
+def test_binary_project_maps_the_steps(tmp_path):
+    path = str(tmp_path / 'loop.bhmb')
+    projectfile.save(full_loop(), path)
+    with projectfile.BinaryProject(path) as project:
+        assert list(project.tracks) == ['kick', 'bass', 'lead']
+        steps, notes = project.steps('bass'), project.notes('bass')
+        assert list(steps) == [1, 5, 9, 14] and list(notes) == [40, 43, 45, 47]
+        if isinstance(steps, memoryview):
+            steps.release()
+            notes.release()
+        assert project.routes['lead'] == ('sýnth 2', 15)
+        assert project.note_gates['bass'] == {9: 0.25}
@@ -0,0 +1,83 @@
+import csv
+import json
+import time
+from threading import Event
+from engine import Engine
+from output import Output, NullPort
+from timing import TimingLog, buffer_size
+
+def test_stats_and_histogram():
+    timing = TimingLog(size = 100)
+    for i in range(10):
+        timing.record(i, i + ((i + 1) / 1000)) # 1 to 10 ms late
+    stats = timing.stats()
+    assert stats['count'] == 10
+    assert round(stats['min'], 6) == 1 and round(stats['max'], 6) == 10
+    assert round(stats['p50'], 6) == 5 and round(stats['p90'], 6) == 9
+    assert round(stats['jitter max'], 6) == 5
+    assert timing.histogram(bucket = 2, buckets = 4) == [1, 2, 2, 5]
+    assert TimingLog().stats() == {'count': 0}
+
+def test_ring_buffer_keeps_the_latest():
+    timing = TimingLog(size = 4)
+    for i in range(10):
+        timing.record(i, i)
+    assert timing.samples() == [(6, 6), (7, 7), (8, 8), (9, 9)]
+    timing.clear()
+    assert timing.samples() == []
+
+def test_in_a_buffer():
+    buffer = bytearray(buffer_size(8))
+    timing = TimingLog(8, buffer)
+    timing.record(1.0, 1.5)
+    # another log over the same buffer, as in another process, sees it
+    other = TimingLog(8, buffer)
+    assert other.samples() == [(1.0, 1.5)]
+    copy = other.copy()
+    timing.release()
+    other.release()
+    assert copy.samples() == [(1.0, 1.5)]
+
+def test_dump(tmp_path):
+    timing = TimingLog()
+    timing.record(1.0, 1.002)
+    timing.dump(str(tmp_path / 'timing.csv'))
+    with open(tmp_path / 'timing.csv', newline = '') as file:
+        rows = list(csv.reader(file))
+    assert rows[0] == ['intended', 'actual', 'latency_ms'] and len(rows) == 2
+    timing.dump(str(tmp_path / 'timing.json'))
+    with open(tmp_path / 'timing.json') as file:
+        dumped = json.load(file)
+    assert dumped['stats']['count'] == 1 and dumped['samples'] == [[1.0, 1.002]]
+
+def test_output_records_what_it_sends_to_a_null_port():
+    # the whole path from engine to port, with nothing but a NullPort at the end
+    ports = []
+    def make_port():
+        ports.append(NullPort())
+        return ports[-1]
+    output = Output(make_port = make_port)
+    output.set_default('null')
+    engine = Engine()
+    engine.start()
+    done = Event()
+    sent = []
+    def send(messages, deadline):
+        output.send(messages, deadline)
+        sent.append(deadline)
+        if len(sent) == 100:
+            done.set()
+    steps = ((beat, ((None, (0x90, 60, 127)), (None, (0x90, 64, 127))), (), ()) for beat in range(100))
+    try:
+        engine.restart(6000)
+        engine.play(steps, send, lookahead = 0.1)
+        assert done.wait(5)
+        time.sleep(0.05)
+    finally:
+        engine.stop()
+        output.stop()
+    stats = output.timing.stats()
+    assert stats['count'] == 200
+    assert stats['min'] >= 0 and stats['p50'] < 5
+    assert ports[-1].sent >= 200 # and the releases when it stopped
+    assert output.timing.summary()[0] == 'timing: 200 messages'
@@ -0,0 +1,101 @@
+# timing accuracy measurements: when each midi message was meant to go out against when it actually did
+
+from array import array
+import csv
+import json
+import math
+
+class TimingLog:
+    # ring buffer of (intended, actual) send times in seconds, keeping the last size of them. there's no lock: only
+    # one thread (the output worker) records, and it fills in an entry before bumping the counter, so a reader that
+    # copies out with samples() only ever sees finished entries. one that's very slow could see the oldest few
+    # overwritten by newer ones part way through, which doesn't matter for statistics.
+    # given a buffer (of at least buffer_size(size) bytes, e.g. shared memory) it's kept in that instead, so a log
+    # recorded in one process can be read from another
+    def __init__(self, size = 65536, buffer = None):
+        self.size = size
+        if buffer is None:
+            self.intended = array('d', [0]) * size
+            self.actual = array('d', [0]) * size
+            self.counter = array('q', [0]) # counter[0] is everything ever recorded, the next entry goes at that % size
+        else:
+            view = memoryview(buffer)
+            self.intended = view[:8 * size].cast('d')
+            self.actual = view[8 * size:16 * size].cast('d')
+            self.counter = view[16 * size:(16 * size) + 8].cast('q')
+            view.release()
+    def record(self, intended, actual):
+        i = self.counter[0] % self.size
+        self.intended[i] = intended
+        self.actual[i] = actual
+        self.counter[0] += 1
+    def clear(self):
+        self.counter[0] = 0
+    def copy(self):
+        # a log with the same samples that doesn't share a buffer, e.g. for keeping after a shared one goes away
+        timing = TimingLog(self.size)
+        timing.intended = array('d', self.intended)
+        timing.actual = array('d', self.actual)
+        timing.counter[0] = self.counter[0]
+        return timing
+    def release(self):
+        # let go of the buffer it was given, it can't be used after this
+        if isinstance(self.intended, memoryview):
+            for view in (self.intended, self.actual, self.counter):
+                view.release()
+    def samples(self):
+        # [(intended, actual)] oldest first
+        count = self.counter[0]
+        start = max(count - self.size, 0)
+        return [(self.intended[i % self.size], self.actual[i % self.size]) for i in range(start, count)]
+    def latencies(self):
+        # how late each message was, in milliseconds
+        return [(actual - intended) * 1000 for intended, actual in self.samples()]
+    def stats(self, percentiles = (50, 90, 99)):
+        # latency percentiles and jitter (how far latency strays from its median) percentiles, in milliseconds
+        latencies = sorted(self.latencies())
+        if len(latencies) == 0:
+            return {'count': 0}
+        median = percentile(latencies, 50)
+        jitter = sorted(abs(latency - median) for latency in latencies)
+        result = {'count': len(latencies), 'mean': sum(latencies) / len(latencies), 'min': latencies[0], 'max': latencies[-1]}
+        for p in percentiles:
+            result[f'p{p}'] = percentile(latencies, p)
+        for p in percentiles:
+            result[f'jitter p{p}'] = percentile(jitter, p)
+        result['jitter max'] = jitter[-1]
+        return result
+    def histogram(self, bucket = 0.5, buckets = 20):
+        # counts of latencies in bucket millisecond wide bins starting at 0, anything early goes in the first
+        # and anything later than the last goes in the last
+        counts = [0] * buckets
+        for latency in self.latencies():
+            counts[min(max(int(latency // bucket), 0), buckets - 1)] += 1
+        return counts
+    def summary(self):
+        # a few lines of text for an on screen overlay
+        stats = self.stats()
+        if stats['count'] == 0:
+            return ['timing: nothing sent yet']
+        return [f"timing: {stats['count']} messages",
+                f"latency ms p50 {stats['p50']:.2f} p99 {stats['p99']:.2f} max {stats['max']:.2f}",
+                f"jitter ms p50 {stats['jitter p50']:.2f} p99 {stats['jitter p99']:.2f} max {stats['jitter max']:.2f}"]
+    def dump(self, path):
+        # csv of every sample if path ends in .csv, otherwise json with the stats, histogram and samples
+        if path.endswith('.csv'):
+            with open(path, 'w', newline = '') as file:
+                writer = csv.writer(file)
+                writer.writerow(['intended', 'actual', 'latency_ms'])
+                for intended, actual in self.samples():
+                    writer.writerow([intended, actual, (actual - intended) * 1000])
+        else:
+            with open(path, 'w') as file:
+                json.dump({'stats': self.stats(), 'histogram': self.histogram(), 'samples': self.samples()}, file)
+
+def buffer_size(size):
+    # bytes needed for a TimingLog of size samples kept in a buffer
+    return (16 * size) + 8
+
+def percentile(ordered, p):
+    # nearest rank, ordered has to be sorted and not empty
+    return ordered[min(max(math.ceil(p / 100 * len(ordered)) - 1, 0), len(ordered) - 1)]